@@ -1,37 +1,238 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, Response, stream_with_context, g
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
 from werkzeug.utils import secure_filename
 from config import Config
-from models import db, User, ChatData
+from database import init_database
+from models import (db, User, UserIdentity, ChatData, UploadJob, replace_examples, save_profile,
+                    migrate_legacy_chat_data, load_participants, load_participant_messages, drop_participant_blobs,
+                    load_user_identity, user_exists)
+from caching import LRUCache
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
+import click
+import uuid
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
 import os
 import json
-from parse_chat import parse_chat_file
-from chatbot import get_chatbot_response
-from datetime import datetime, timedelta
+from jobs import submit_upload
+from bulk_import import (submit_bulk_upload, submit_personas, import_archive, create_personas, discard_sources,
+                         job_files, job_personas)
+from batch_replay import load_script, persona_from_chat, persona_from_export, run_replay
+from llm_backends import BACKENDS, reset_llms
+from routing import router_from_config, set_router
+from maintenance import TempChatSweeper, prepare_database, purge_expired_temp_chats, database_size, vacuum_database
+from style_profile import build_style_profile, clean_messages
+from chatbot import (get_chatbot_response, stream_chatbot_response, get_persona_session, warm_persona_session,
+                     prewarm_llm, ChatbotError, ChatNotFound, BUSY_MESSAGE, TIMEOUT_MESSAGE)
+from llm_executor import llm_executor, LLMSaturated, LLMTimeout
+from metrics import span, render_metrics, REQUEST_SECONDS, PAYLOAD_BYTES, request_logger
+import time
+import logging
+import threading
 
 app = Flask(__name__)
 app.config.from_object(Config)
-db.init_app(app)
+init_database(app, db)
 
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login'
 
+# user id -> UserIdentity; per process, dropped on logout and whenever the User row changes
+_user_cache = LRUCache(maxsize=Config.USER_CACHE_SIZE, ttl=Config.USER_CACHE_TTL)
+
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
-
-# Create DB tables and clean up old temp entries on startup
-with app.app_context():
-    db.create_all()
-    # Optional: Clean up old temp entries (older than 1 hour)
-    cutoff = datetime.utcnow() - timedelta(hours=1)
-    temp_entries = ChatData.query.filter_by(is_temp=True).filter(ChatData.created_at < cutoff).all()
-    for entry in temp_entries:
-        db.session.delete(entry)
+    user_id = int(user_id)
+    identity = _user_cache.get(user_id)
+    if identity is None:
+        identity = load_user_identity(user_id)
+        if identity is not None:
+            _user_cache.set(user_id, identity)
+    return identity
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def _user_changed(mapper, connection, target):
+    _user_cache.pop(target.id)
+
+# Startup work runs once per worker on its first request instead of at import,
+# so spawning a worker (or importing the app in a CLI/test process) stays cheap
+_startup_lock = threading.Lock()
+_startup_done = False
+temp_sweeper = None
+
+def run_startup_tasks():
+    """
+    Create/migrate the schema (DB_AUTO_SETUP), start the temp sweeper and prewarm the tokenizer and LLM client (LLM_PREWARM).
+    Only the first call does anything.
+    """
+    global _startup_done, temp_sweeper
+    if _startup_done:
+        return
+    with _startup_lock:
+        if _startup_done:
+            return
+        if app.config.get('DB_AUTO_SETUP'):
+            prepare_database()
+        # Expired temp uploads are deleted in bounded batches by a background thread
+        if app.config.get('TEMP_SWEEP_INTERVAL'):
+            temp_sweeper = TempChatSweeper(
+                app,
+                interval=app.config['TEMP_SWEEP_INTERVAL'],
+                max_age=app.config['TEMP_CHAT_MAX_AGE'],
+                batch_size=app.config['TEMP_SWEEP_BATCH'],
+                vacuum_ratio=app.config.get('TEMP_SWEEP_VACUUM'),
+            ).start()
+        if app.config.get('LLM_PREWARM'):
+            threading.Thread(target=prewarm_llm, name='llm-prewarm', daemon=True).start()
+        _startup_done = True
+
+def _cli_database_setup():
+    # CLI commands never see a request, so they set up the schema themselves
+    if app.config.get('DB_AUTO_SETUP'):
+        prepare_database()
+
+@app.cli.command('init-db')
+def init_db_command():
+    """Create tables and indexes and migrate legacy data (run once per deploy when DB_AUTO_SETUP=0)."""
+    print(f"Database ready ({prepare_database()} legacy chats migrated).")
+
+@app.cli.command('migrate-chat-data')
+def migrate_chat_data_command():
+    """Move ChatData.messages/conversation_history JSON into ExampleMessage/ConversationTurn rows."""
+    print(f"Migrated {migrate_legacy_chat_data()} chats.")
+
+@app.cli.command('import-chats')
+@click.argument('archive', type=click.Path(exists=True, dir_okay=False))
+@click.option('--user', 'username', required=True, help='Owner of the new personas.')
+@click.option('--person', 'persons', multiple=True, help='Only import these participants (repeatable).')
+@click.option('--min-messages', type=int, default=None, help='Skip participants with fewer messages.')
+@click.option('--workers', type=int, default=None, help='Parser processes (default: one per CPU).')
+def import_chats_command(archive, username, persons, min_messages, workers):
+    """Bulk-import a .zip of chat exports: one persona per participant, then a throughput report."""
+    _cli_database_setup()
+    user = User.query.filter_by(username=username).first()
+    if not user:
+        raise click.ClickException(f"No user named {username!r}.")
+    if min_messages is None:
+        min_messages = app.config['BULK_MIN_MESSAGES']
+    
+    job = UploadJob(id=uuid.uuid4().hex, user_id=user.id, status='queued')
+    db.session.add(job)
     db.session.commit()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        try:
+            report = import_archive(executor, user.id, job.id, archive, app.config['BULK_BATCH_SIZE'])
+        except (ValueError, zipfile.BadZipFile) as e:
+            raise click.ClickException(str(e))
+    job.status = 'ready'
+    
+    files = job_files(job.id)
+    selections = [(f.chat_id, p['name']) for f, participants in files for p in participants
+                  if p['count'] >= min_messages and (not persons or p['name'] in persons)]
+    create_personas(user.id, selections, app.config['BULK_BATCH_SIZE'], report)
+    discard_sources([f.chat_id for f, _ in files if f.chat_id])
+    
+    for f, _ in files:
+        if f.error:
+            print(f"  failed: {f.filename}: {f.error}")
+    print(report.summary())
+
+@app.cli.command('replay')
+@click.argument('script', type=click.File('r', encoding='utf-8'))
+@click.option('--chat', 'chat_id', type=int, help='Persona: an existing chat (its stored history is left alone).')
+@click.option('--export', 'export_file', type=click.File('r', encoding='utf-8-sig'),
+              help='Persona: a raw chat export instead of a stored chat.')
+@click.option('--person', help='Participant of --export to emulate (default: the most active).')
+@click.option('--out', type=click.File('w', encoding='utf-8'), default='-', help='Results JSONL (default: stdout).')
+@click.option('--workers', type=int, default=None, help='Conversations in flight (default: LLM_MAX_CONCURRENCY).')
+@click.option('--backend', type=click.Choice(sorted(BACKENDS)), help='LLM backend for this run (default: LLM_BACKEND).')
+def replay_command(script, chat_id, export_file, person, out, workers, backend):
+    """Replay a JSONL of turns/conversations against a persona and report throughput, latency and tokens."""
+    if (chat_id is None) == (export_file is None):
+        raise click.UsageError("Pass exactly one of --chat or --export.")
+    try:
+        conversations = load_script(script)
+        if chat_id is not None:
+            _cli_database_setup()
+            persona = persona_from_chat(chat_id)
+        else:
+            persona = persona_from_export(export_file, person)
+    except (ValueError, ChatbotError) as e:
+        raise click.ClickException(str(e).removeprefix('Error: '))
+    
+    if backend:
+        # Clients and the router are only built on first use, so switching here is enough
+        Config.LLM_BACKEND = backend
+        reset_llms()
+        set_router(router_from_config())
+    
+    report = run_replay(persona, conversations, out, workers)
+    click.echo(report.summary(), err=True)  # stderr, so --out - stays pure JSONL
+
+@app.cli.command('purge-temp-chats')
+@click.option('--vacuum', is_flag=True, help='VACUUM the SQLite file afterwards to give the space back.')
+def purge_temp_chats_command(vacuum):
+    """Delete expired temp uploads now and report the database size."""
+    _cli_database_setup()
+    chats, jobs = purge_expired_temp_chats(app.config['TEMP_CHAT_MAX_AGE'], app.config['TEMP_SWEEP_BATCH'])
+    print(f"Purged {chats} temp chats and {jobs} upload jobs.")
+    if vacuum:
+        vacuum_database()
+    size = database_size()
+    if size:
+        print(f"Database: {size['bytes'] / 1e6:.1f} MB, {size['free_bytes'] / 1e6:.1f} MB reclaimable by VACUUM.")
+
+if app.config.get('METRICS_REQUEST_LOG') and not request_logger.handlers:
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter('%(message)s'))
+    request_logger.addHandler(_handler)
+    request_logger.setLevel(logging.INFO)
 
-ALLOWED_EXTENSIONS = {'txt'}
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+# Registered after the timer so the first request's latency includes the deferred startup work
+app.before_request(run_startup_tasks)
+
+@app.after_request
+def record_request_metrics(response):
+    start = g.pop('request_start', None)
+    if start is None:
+        return response
+    elapsed = time.perf_counter() - start
+    endpoint = request.endpoint or 'unknown'
+    REQUEST_SECONDS.observe(elapsed, endpoint=endpoint, method=request.method, status=response.status_code)
+    if request.content_length:
+        PAYLOAD_BYTES.observe(request.content_length, endpoint=endpoint, direction='in')
+    if response.content_length is not None:
+        PAYLOAD_BYTES.observe(response.content_length, endpoint=endpoint, direction='out')
+    
+    if app.config.get('METRICS_REQUEST_LOG'):
+        # One structured line per request: totals plus the per-stage spans recorded along the way
+        entry = {
+            'endpoint': endpoint,
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'duration_ms': round(elapsed * 1000, 2),
+            'stages_ms': {k: round(v * 1000, 2) for k, v in g.get('metrics_stages', {}).items()},
+        }
+        entry.update(g.get('metrics_extra', {}))
+        request_logger.info(json.dumps(entry))
+    return response
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus scrape endpoint."""
+    if not app.config.get('METRICS_ENABLED', True):
+        return 'Not found', 404
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+ALLOWED_EXTENSIONS = {'txt', 'zip'}  # .zip = bulk import of several exports
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
@@ -49,14 +250,20 @@ def signup():
         email = request.form['email']
         password = request.form['password']
         
-        if User.query.filter_by(username=username).first() or User.query.filter_by(email=email).first():
+        if user_exists(username, email):
             flash('Username or email already exists.')
             return redirect(url_for('signup'))
         
         user = User(username=username, email=email)
         user.set_password(password)
         db.session.add(user)
-        db.session.commit()
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Someone signed up with the same name between the check and the insert
+            db.session.rollback()
+            flash('Username or email already exists.')
+            return redirect(url_for('signup'))
         flash('Signup successful! Please log in.')
         return redirect(url_for('login'))
     
@@ -71,6 +278,7 @@ def login():
         user = User.query.filter_by(username=username).first()
         if user and user.check_password(password):
             login_user(user)
+            _user_cache.set(user.id, UserIdentity(user.id, user.username, user.email))
             return redirect(url_for('dashboard'))
         flash('Invalid username or password.')
     
@@ -79,13 +287,15 @@ def login():
 @app.route('/logout')
 @login_required
 def logout():
+    _user_cache.pop(current_user.id)
     logout_user()
     return redirect(url_for('login'))
 
 @app.route('/dashboard')
 @login_required
 def dashboard():
-    return render_template('dashboard.html')
+    # job_id is set after a form upload; the page polls it until the chat is parsed
+    return render_template('dashboard.html', job_id=request.args.get('job_id'))
 
 """@app.route('/upload', methods=['POST'])
 @login_required
@@ -129,51 +339,62 @@ def upload_file():
 @app.route('/upload', methods=['POST'])
 @login_required
 def upload_file():
-    if 'file' not in request.files:
-        flash('No file selected.')
+    """
+    Queue the export for background parsing and return at once.
+    JSON clients get {'job_id', 'status_url'} (202); plain form posts go back to the dashboard,
+    which polls the job until the chat is ready for select_person (or bulk_select for a .zip).
+    """
+    wants_json = request.accept_mimetypes.best == 'application/json'
+    
+    def fail(message, status=400):
+        if wants_json:
+            return jsonify({'error': message}), status
+        flash(message)
         return redirect(url_for('dashboard'))
     
+    if 'file' not in request.files:
+        return fail('No file selected.')
+    
     file = request.files['file']
     if file.filename == '':
-        flash('No file selected.')
-        return redirect(url_for('dashboard'))
+        return fail('No file selected.')
     
     if file and allowed_file(file.filename):
         try:
-            content = file.read().decode('utf-8')
-            parsed = parse_chat_file(content)
-            
-            # This check is now inside the try block
-            if len(parsed['participants']) < 2:
-                flash('Parsing failed: The chat must have at least two participants.')
-                return redirect(url_for('dashboard'))
-            
-            # Create temporary ChatData entry
-            temp_chat = ChatData(
-                user_id=current_user.id,
-                selected_person=None,
-                all_messages=json.dumps(parsed['messages_by_person']),
-                messages='[]',
-                conversation_history='[]',
-                is_temp=True
-            )
-            db.session.add(temp_chat)
-            db.session.commit()
-            
-            return redirect(url_for('select_person', chat_id=temp_chat.id))
-
-        except (ValueError, IndexError) as e:
-            # Catch parsing errors and give a user-friendly message
-            flash(f"Error parsing chat file: {e}. Please ensure it's a valid WhatsApp chat export.")
-            return redirect(url_for('dashboard'))
-        
+            with span('upload_enqueue'):
+                if file.filename.lower().endswith('.zip'):
+                    job_id = submit_bulk_upload(app, current_user.id, file)
+                else:
+                    job_id = submit_upload(app, current_user.id, file)
         except Exception as e:
             # Catch any other unexpected errors
-            flash(f"An unexpected error occurred: {e}")
-            return redirect(url_for('dashboard'))
+            app.logger.exception("Upload failed")
+            return fail(f"An unexpected error occurred: {e}", 500)
+        
+        if wants_json:
+            return jsonify({'job_id': job_id, 'status_url': url_for('upload_status', job_id=job_id)}), 202
+        return redirect(url_for('dashboard', job_id=job_id))
+    
+    return fail('Invalid file type. Only .txt or .zip files are allowed.')
+
+@app.route('/api/upload/<job_id>')
+@login_required
+def upload_status(job_id):
+    """Poll an upload job: queued -> ready (with select_url) or failed (with error)."""
+    job = UploadJob.query.filter_by(id=job_id, user_id=current_user.id).first()
+    if not job:
+        return jsonify({'error': 'Upload job not found'}), 404
     
-    flash('Invalid file type. Only .txt files are allowed.')
-    return redirect(url_for('dashboard'))
+    payload = {'job_id': job.id, 'status': job.status}
+    if job.status == 'ready':
+        # Bulk (zip) jobs have no single chat; their files are listed on bulk_select
+        if job.chat_id is None:
+            payload['select_url'] = url_for('bulk_select', job_id=job.id)
+        else:
+            payload['select_url'] = url_for('select_person', chat_id=job.chat_id)
+    elif job.status == 'failed':
+        payload['error'] = job.error
+    return jsonify(payload)
 
 @app.route('/select_person', methods=['GET', 'POST'])
 @login_required
@@ -186,30 +407,41 @@ def select_person():
             return redirect(url_for('dashboard'))
         
         # Load temp ChatData
-        temp_chat = ChatData.query.filter_by(id=chat_id, user_id=current_user.id, is_temp=True).first()
+        with span('select_load'):
+            temp_chat = ChatData.query.filter_by(id=chat_id, user_id=current_user.id, is_temp=True).first()
         if not temp_chat:
             flash('Chat data not found or expired.')
             return redirect(url_for('dashboard'))
         
-        # Extract messages for selected person
-        all_messages_dict = json.loads(temp_chat.all_messages)
-        selected_msgs = all_messages_dict.get(person_name, [])
+        # Inflate only the selected person's messages
+        with span('select_decode'):
+            selected_msgs = load_participant_messages(temp_chat.id, person_name)
         if not selected_msgs:
             flash('No messages for selected person.')
             return redirect(url_for('dashboard'))
         
-        # Use more of the chat: first 300 messages (adjust based on your avg chat size; ~300 is safe for GPT-4o)
-        selected_msgs = selected_msgs[:300]
+        # Profile once here: drop media placeholders / "." lines and near-duplicates, fingerprint the style
+        with span('select_profile'):
+            profile = build_style_profile(selected_msgs, n_examples=Config.STYLE_CURATED_EXAMPLES)
+            example_msgs = clean_messages(selected_msgs)
+        if not example_msgs:
+            flash('No usable messages for selected person.')
+            return redirect(url_for('dashboard'))
+        
+        # Keep the whole (cleaned) history: each turn retrieves only the relevant examples from it
+        # Store as ExampleMessage rows (no roles needed, since we'll use them only as style examples)
+        with span('select_store'):
+            temp_chat.selected_person = person_name
+            replace_examples(temp_chat.id, example_msgs)
+            save_profile(temp_chat.id, profile)
+            temp_chat.is_temp = False
+            temp_chat.all_messages = ''  # Clear temp data to save space
+            drop_participant_blobs([temp_chat.id])
+            db.session.commit()
         
-        # Store as simple list of strings (no roles needed, since we'll use them only as style examples)
-        # Also initialize conversation_history as empty list if not already
-        temp_chat.selected_person = person_name
-        temp_chat.messages = json.dumps(selected_msgs)  # Now a list of str, not dicts
-        if not hasattr(temp_chat, 'conversation_history') or temp_chat.conversation_history is None:
-            temp_chat.conversation_history = '[]'
-        temp_chat.is_temp = False
-        temp_chat.all_messages = ''  # Clear temp data to save space
-        db.session.commit()
+        # Build the persona session (style index, prompt) now so the first chat turn doesn't pay for it
+        with span('select_warm_session'):
+            warm_persona_session(chat_id)
         
         return redirect(url_for('chat', chat_id=chat_id))
     
@@ -219,17 +451,55 @@ def select_person():
         flash('No chat ID provided.')
         return redirect(url_for('dashboard'))
     
-    temp_chat = ChatData.query.filter_by(id=chat_id, user_id=current_user.id, is_temp=True).first()
+    with span('select_load'):
+        temp_chat = ChatData.query.filter_by(id=chat_id, user_id=current_user.id, is_temp=True).first()
     if not temp_chat:
         flash('Chat data not found or expired.')
         return redirect(url_for('dashboard'))
     
-    all_messages_dict = json.loads(temp_chat.all_messages)
-    participants = [{'name': name, 'count': len(msgs)} for name, msgs in all_messages_dict.items()]
-    sorted_participants = sorted(participants, key=lambda x: x['count'], reverse=True)[:2]
+    # Counts come from their own columns; the message blobs aren't read here
+    with span('select_participants'):
+        sorted_participants = load_participants(temp_chat.id)[:2]
     
     return render_template('select_person.html', participants=sorted_participants, chat_id=chat_id)
 
+@app.route('/bulk_select', methods=['GET', 'POST'])
+@login_required
+def bulk_select():
+    """
+    Pick any number of participants from a bulk import; each one becomes its own persona.
+    The bots are built in the background; the page polls the job and lists them once they're ready.
+    """
+    job_id = request.values.get('job_id', '')
+    job = UploadJob.query.filter_by(id=job_id, user_id=current_user.id, status='ready').first()
+    if not job:
+        flash('Import not found or expired.')
+        return redirect(url_for('dashboard'))
+    
+    created = job_personas(job.id)
+    if created:
+        return render_template('bulk_select.html', job_id=job.id, created=created)
+    
+    files = job_files(job.id)
+    if request.method == 'POST':
+        # Checkbox values are "<temp chat id>:<participant name>"; only this job's chats are accepted
+        source_ids = {f.chat_id for f, _ in files if f.chat_id}
+        selections = []
+        for value in request.form.getlist('persona'):
+            chat_id, _, name = value.partition(':')
+            if chat_id.isdigit() and int(chat_id) in source_ids and name:
+                selections.append((int(chat_id), name))
+        if not selections:
+            flash('Select at least one person.')
+            return redirect(url_for('bulk_select', job_id=job.id))
+        
+        if not submit_personas(app, job, selections, source_ids):
+            flash('These bots are already being created.')
+        return render_template('bulk_select.html', job_id=job.id, creating=len(selections))
+    
+    return render_template('bulk_select.html', job_id=job.id, files=files,
+                           min_messages=app.config['BULK_MIN_MESSAGES'])
+
 @app.route('/chat/<int:chat_id>')
 @login_required
 def chat(chat_id):
@@ -248,8 +518,46 @@ def api_chat(chat_id):
     if not user_input:
         return jsonify({'error': 'No message provided'}), 400
     
-    response = get_chatbot_response(chat_id, user_input)
+    try:
+        response = get_chatbot_response(chat_id, user_input, user_id=current_user.id)
+    except ChatNotFound:
+        return jsonify({'error': 'Chat not found'}), 404
+    except LLMSaturated:
+        # Fail fast instead of parking this worker thread behind a full LLM queue
+        return jsonify({'error': BUSY_MESSAGE}), 503, {'Retry-After': str(app.config['LLM_RETRY_AFTER'])}
+    except LLMTimeout:
+        return jsonify({'error': TIMEOUT_MESSAGE}), 504
     return jsonify({'response': response})
 
+@app.route('/api/chat/<int:chat_id>/stream', methods=['POST'])
+@login_required
+def api_chat_stream(chat_id):
+    """Server-sent events version of api_chat: one 'data:' event per token chunk, then 'event: done'."""
+    data = request.json
+    user_input = data.get('message')
+    if not user_input:
+        return jsonify({'error': 'No message provided'}), 400
+    if llm_executor.saturated():
+        return jsonify({'error': BUSY_MESSAGE}), 503, {'Retry-After': str(app.config['LLM_RETRY_AFTER'])}
+    try:
+        # Ownership check (and session load) before the 200 + event stream starts
+        get_persona_session(chat_id, current_user.id)
+    except ChatNotFound:
+        return jsonify({'error': 'Chat not found'}), 404
+    except ChatbotError:
+        pass  # e.g. no examples: the stream yields the message
+    
+    def events():
+        for chunk in stream_chatbot_response(chat_id, user_input, user_id=current_user.id):
+            yield f"data: {json.dumps({'token': chunk})}\n\n"
+        yield "event: done\ndata: {}\n\n"
+    
+    # stream_with_context keeps the app/DB context alive while the generator runs
+    return Response(
+        stream_with_context(events()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
 if __name__ == '__main__':
     app.run(debug=True)
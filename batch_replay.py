@@ -0,0 +1,167 @@
+import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from config import Config
+from parse_chat import parse_chat_file
+from style_profile import build_style_profile, clean_messages
+from chatbot import PersonaSession, ChatbotError, get_persona_session, summarize_history
+from llm_executor import LLMSaturated
+from metrics import percentile
+from routing import get_router
+from token_budget import count_tokens
+
+logger = logging.getLogger(__name__)
+
+
+def load_script(lines):
+    """
+    Read replay input (JSONL, one object per line; blank lines skipped):
+    {"id": "greet-1", "message": "kya haal hai"}                    one turn, its own conversation
+    {"id": "plans", "turns": ["kal free ho?", "chalo phir 5 baje"]}  a scripted conversation, turns in order
+    "id" is optional (defaults to the line number). Raises ValueError naming the bad line.
+    """
+    conversations = []
+    for lineno, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            item = json.loads(line)
+        except ValueError as e:
+            raise ValueError(f"Line {lineno}: not valid JSON ({e})")
+        turns = item.get('turns') if isinstance(item, dict) else None
+        if turns is None and isinstance(item, dict) and 'message' in item:
+            turns = [item['message']]
+        if not turns or not all(isinstance(turn, str) and turn.strip() for turn in turns):
+            raise ValueError(f"Line {lineno}: expected {{\"message\": str}} or {{\"turns\": [str, ...]}}")
+        conversations.append({'id': item.get('id', lineno), 'turns': turns})
+    return conversations
+
+
+def persona_from_chat(chat_id):
+    """The persona of an existing chat, forked so the replay never touches its stored history."""
+    return get_persona_session(chat_id).fork()
+
+
+def persona_from_export(chat_source, person=None):
+    """
+    Build a persona straight from a raw export (nothing is stored): cleaned examples + style profile,
+    like select_person does. person defaults to the most active participant.
+    """
+    parsed = parse_chat_file(chat_source)
+    messages_by_person = parsed['messages_by_person']
+    if person is None:
+        person = parsed['participants'][0]['name']
+    elif person not in messages_by_person:
+        raise ChatbotError(f"No participant named {person!r} in the export "
+                           f"(found: {', '.join(sorted(messages_by_person))}).")
+    msgs = messages_by_person[person]
+    examples = clean_messages(msgs)
+    if not examples:
+        raise ChatbotError(f"Error: No example messages found for {person}.")
+    profile = build_style_profile(msgs, n_examples=Config.STYLE_CURATED_EXAMPLES)
+    return PersonaSession(None, person, examples, [], 0, profile=profile)
+
+
+class ReplayReport:
+    """Totals of one replay run: throughput, turn latency percentiles, prompt tokens and tiers used."""
+
+    def __init__(self):
+        self.conversations = 0
+        self.failed = 0
+        self.latencies = []  # seconds per answered turn
+        self.prompt_tokens = 0
+        self.tiers = {}
+        self.seconds = 0.0
+
+    def add(self, result):
+        self.conversations += 1
+        if result['error']:
+            self.failed += 1
+        for turn in result['turns']:
+            self.latencies.append(turn['latency_ms'] / 1000)
+            self.prompt_tokens += turn['prompt_tokens']
+            self.tiers[turn['tier']] = self.tiers.get(turn['tier'], 0) + 1
+
+    def percentile(self, pct):
+        return percentile(sorted(self.latencies), pct, default=0.0)
+
+    def summary(self):
+        turns = len(self.latencies)
+        seconds = self.seconds or 1e-9
+        return "\n".join([
+            f"Replayed {self.conversations} conversations ({self.failed} failed), {turns} turns "
+            f"in {self.seconds:.2f}s: {self.conversations / seconds:.1f} conversations/sec, {turns / seconds:.1f} turns/sec",
+            f"Turn latency: p50 {self.percentile(50) * 1000:.0f} ms, p95 {self.percentile(95) * 1000:.0f} ms, "
+            f"p99 {self.percentile(99) * 1000:.0f} ms",
+            f"Prompt tokens: {self.prompt_tokens} total, {self.prompt_tokens / (turns or 1):.0f} per turn; "
+            f"tiers: {', '.join(f'{tier} {n}' for tier, n in sorted(self.tiers.items())) or '-'}",
+        ])
+
+
+def _invoke(router, prompt_text, tier, retries=5):
+    # The worker pool is sized to the LLM executor, but a summary call can still find it full for a moment
+    for attempt in range(retries):
+        try:
+            return router.invoke(prompt_text, tier)
+        except LLMSaturated:
+            if attempt == retries - 1:
+                raise
+            time.sleep(0.1 * (attempt + 1))
+
+
+def replay_conversation(persona, conversation, router=None):
+    """
+    Play one conversation against a fork of persona, entirely in memory (no DB writes, no response cache).
+    History is carried between its turns and folded into a summary as in a live chat.
+    Returns {'id', 'turns': [{'input', 'response', 'tier', 'latency_ms', 'prompt_tokens'}], 'seconds', 'error'}.
+    """
+    router = router or get_router()
+    session = persona.fork()
+    result = {'id': conversation['id'], 'turns': [], 'seconds': 0.0, 'error': None}
+    start = time.perf_counter()
+    try:
+        for user_input in conversation['turns']:
+            turn_start = time.perf_counter()
+            prompt_text = session.render_prompt(user_input)
+            tier, _ = router.choose(user_input)
+            reply = _invoke(router, prompt_text, tier)
+            response = (getattr(reply, "content", reply) or "").strip()
+            result['turns'].append({
+                'input': user_input,
+                'response': response,
+                'tier': tier,
+                'latency_ms': round((time.perf_counter() - turn_start) * 1000, 1),
+                'prompt_tokens': count_tokens(prompt_text),
+            })
+            _, to_fold = session.record_turn(user_input, response)
+            if to_fold:
+                session.apply_summary(summarize_history(session.selected_person, session.summary, to_fold),
+                                      to_fold[-1]["seq"])
+    except Exception as e:
+        logger.debug("Replay of %s failed", conversation['id'], exc_info=True)
+        result['error'] = f"{type(e).__name__}: {e}"
+    result['seconds'] = round(time.perf_counter() - start, 3)
+    return result
+
+
+def run_replay(persona, conversations, out, workers=None, router=None):
+    """
+    Replay conversations concurrently on a bounded thread pool (workers defaults to LLM_MAX_CONCURRENCY,
+    so calls don't pile up in the LLM queue). Each result is written to `out` as a JSON line as soon as
+    its conversation finishes (so in completion order, not input order). Returns a ReplayReport.
+    """
+    router = router or get_router()
+    report = ReplayReport()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers or Config.LLM_MAX_CONCURRENCY,
+                            thread_name_prefix='replay') as pool:
+        futures = [pool.submit(replay_conversation, persona, conversation, router) for conversation in conversations]
+        for future in as_completed(futures):
+            result = future.result()
+            out.write(json.dumps(result, ensure_ascii=False) + "\n")
+            out.flush()
+            report.add(result)
+    report.seconds = time.perf_counter() - start
+    return report
@@ -0,0 +1,71 @@
+"""
+Parser throughput benchmark: lines/sec per export dialect on synthetic chats.
+
+Usage (from the repo root):
+    python benchmarks/bench_parse.py
+    python benchmarks/bench_parse.py --lines 200000 --dialect android
+"""
+import argparse
+import io
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from parse_chat import DIALECTS, iter_chat_messages
+
+SENDERS = ['Ali Khan', 'Sara', 'Hamza', 'Ayesha 🌸']
+TEXTS = [
+    'kya haal hai', 'Theek hun yaar tum sunao', '<Media omitted>', 'ok', '😂😂',
+    'Kal class hai kya?', 'Bhai notes bhej dena please', 'haan done', '.',
+]
+
+
+def header(dialect, i):
+    day, month, hour, minute = i % 28 + 1, i % 12 + 1, i % 12 + 1, i % 60
+    ampm = 'PM' if i % 2 else 'AM'
+    if dialect == 'ios':
+        return f"[{day}/{month}/2023, {hour}:{minute:02d}:00 {ampm}]"
+    return f"{day}/{month}/2023, {hour}:{minute:02d} {ampm.lower()} -"
+
+
+def make_export(dialect, n_lines, seed=0):
+    """Build an n_lines synthetic export (~10% continuation lines) in the given dialect."""
+    rng = random.Random(seed)
+    out = io.StringIO()
+    for i in range(n_lines):
+        if i and rng.random() < 0.1:
+            out.write(f"{rng.choice(TEXTS)}\n")
+        else:
+            out.write(f"{header(dialect, i)} {rng.choice(SENDERS)}: {rng.choice(TEXTS)}\n")
+    out.seek(0)
+    return out
+
+
+def run(dialect, n_lines, detect):
+    export = make_export(dialect, n_lines)
+    start = time.perf_counter()
+    count = 0
+    for _ in iter_chat_messages(export, None if detect else dialect):
+        count += 1
+    elapsed = time.perf_counter() - start
+    return count, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--lines', type=int, default=1_000_000)
+    parser.add_argument('--dialect', choices=sorted(DIALECTS), action='append')
+    parser.add_argument('--no-detect', action='store_true', help='force the dialect instead of auto-detecting')
+    args = parser.parse_args()
+
+    for dialect in args.dialect or sorted(DIALECTS):
+        count, elapsed = run(dialect, args.lines, not args.no_detect)
+        print(f"{dialect:8s} {args.lines:>9,d} lines  {count:>9,d} msgs  "
+              f"{elapsed:6.2f}s  {args.lines / elapsed:>12,.0f} lines/sec")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,182 @@
+"""
+End-to-end tail latency of /api/chat/<id> with model routing and hedged requests, against stub model tiers
+with injected latency distributions (no network or OpenAI key needed).
+
+Each tier's time to first token is lognormal around its median, and a share of calls stall for a few
+seconds (the provider hiccups hedging is meant to absorb). The same mix of trivial ("ok 😂") and complex
+turns is replayed against:
+    single tier      every turn on "main", no hedging (how the app used to run)
+    routed           trivial turns on "fast", the rest on "main"
+    routed + hedged  the same, plus a duplicate call after the tier's recent p95
+Reports p50/p95/p99/max per configuration, turns routed to each tier and hedges fired/won.
+
+Usage (from the repo root):
+    python benchmarks/bench_routing.py
+    python benchmarks/bench_routing.py --users 16 --turns 40 --stall-share 0.05 --stall 6
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from metrics import percentile
+
+TRIVIAL_INPUTS = ['ok 😂', 'hahaha', 'acha', 'theek hai', 'sahi', '👍', 'lol yaar', 'haan']
+COMPLEX_INPUTS = [
+    'kal ki class ka kya scene hai, sir ne assignment ki deadline barha di ya nahi?',
+    'yaar mujhe batao weekend pe kahan chalna chahiye, lahore ya islamabad?',
+    'tumne woh project wali file bheji thi? mujhe mil nahi rahi kahin bhi',
+    'ammi keh rahi thi tum log shaadi pe aa rahe ho, pakka plan kya hai?',
+]
+
+
+def latency(median, sigma, stall_share, stall, rng):
+    """Lognormal first-token latency with occasional multi-second stalls."""
+    def sample():
+        if rng.random() < stall_share:
+            return stall
+        return rng.lognormvariate(0, sigma) * median
+    return sample
+
+
+def make_router(config, args, seed):
+    from llm_backends import StubLLM
+    from routing import ModelRouter, Tier
+
+    rng = random.Random(seed)
+    tiers = {'main': Tier('main', StubLLM(latency(args.main_median, args.sigma, args.stall_share, args.stall, rng),
+                                          tokens_per_sec=args.tps))}
+    if config != 'single tier':
+        tiers['fast'] = Tier('fast', StubLLM(latency(args.fast_median, args.sigma, args.stall_share, args.stall, rng),
+                                             tokens_per_sec=args.tps * 2))
+    hedge = args.hedge_percentile if config == 'routed + hedged' else 0
+    return ModelRouter(tiers, hedge_percentile=hedge, hedge_min_samples=args.min_samples)
+
+
+def setup_app(users):
+    tmpdir = tempfile.mkdtemp(prefix='botme-routing-')
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tmpdir, 'bench.db')}"
+    os.environ['LLM_BACKEND'] = 'stub'
+    os.environ['LLM_PREWARM'] = '0'
+    os.environ['TEMP_SWEEP_INTERVAL'] = '0'
+    os.environ.setdefault('OPENAI_API_KEY', 'sk-bench')
+    os.environ.setdefault('LLM_MAX_CONCURRENCY', str(users * 2))  # room for hedges next to every user's call
+    os.environ.setdefault('LLM_MAX_QUEUE', str(users * 2))
+
+    from app import app
+    from maintenance import prepare_database
+    from models import db, User, ChatData, replace_examples
+
+    with app.app_context():
+        prepare_database()
+        chats = []
+        for i in range(users):
+            user = User(username=f'u{i}', email=f'u{i}@x')
+            user.set_password('pw')
+            db.session.add(user)
+            db.session.flush()
+            chat = ChatData(user_id=user.id, selected_person='Ali', all_messages='', is_temp=False)
+            db.session.add(chat)
+            db.session.flush()
+            replace_examples(chat.id, [f'example message {j} kya haal hai' for j in range(200)])
+            chats.append((user.username, chat.id))
+        db.session.commit()
+    return app, chats
+
+
+def run_config(app, chats, config, args):
+    from llm_executor import LLM_HEDGES
+    from routing import LLM_ROUTED, set_router
+
+    def routed():
+        return {tier: sum(LLM_ROUTED.value(tier=tier, reason=reason)
+                          for reason in ('single_tier', 'complex', 'trivial', 'probe', 'fast_tier_slow'))
+                for tier in ('main', 'fast')}
+
+    router = make_router(config, args, seed=args.seed)
+    set_router(router)
+    inputs = random.Random(args.seed)
+    turns = [[inputs.choice(TRIVIAL_INPUTS if inputs.random() < args.trivial_share else COMPLEX_INPUTS)
+              for _ in range(args.warmup + args.turns)] for _ in chats]
+    hedges_before = {k: LLM_HEDGES.value(outcome=k) for k in ('fired', 'won')}
+    routed_before = routed()
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+
+    def user(index, username, chat_id):
+        client = app.test_client()
+        client.post('/login', data={'username': username, 'password': 'pw'})
+        for n, message in enumerate(turns[index]):
+            start = time.perf_counter()
+            response = client.post(f'/api/chat/{chat_id}', json={'message': message})
+            elapsed = time.perf_counter() - start
+            if n < args.warmup:
+                continue
+            with lock:
+                if response.status_code != 200:
+                    errors[0] += 1
+                latencies.append(elapsed)
+
+    threads = [threading.Thread(target=user, args=(i, username, chat_id)) for i, (username, chat_id) in enumerate(chats)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        'p50': percentile(latencies, 50, default=0.0),
+        'p95': percentile(latencies, 95, default=0.0),
+        'p99': percentile(latencies, 99, default=0.0),
+        'max': latencies[-1] if latencies else 0.0,
+        'turns/s': len(latencies) / wall,
+        'errors': errors[0],
+        'tiers': {tier: n - routed_before[tier] for tier, n in routed().items() if n - routed_before[tier]},
+        'hedges': {k: LLM_HEDGES.value(outcome=k) - v for k, v in hedges_before.items()},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Tail latency with model routing and hedged requests (stub tiers).')
+    parser.add_argument('--users', type=int, default=8, help='concurrent simulated users (one chat each)')
+    parser.add_argument('--turns', type=int, default=25, help='measured turns per user')
+    parser.add_argument('--warmup', type=int, default=5, help='unmeasured turns per user first (fills latency windows)')
+    parser.add_argument('--trivial-share', type=float, default=0.5, help='share of trivial inputs')
+    parser.add_argument('--main-median', type=float, default=0.5, help='"main" tier median seconds to first token')
+    parser.add_argument('--fast-median', type=float, default=0.15, help='"fast" tier median seconds to first token')
+    parser.add_argument('--sigma', type=float, default=0.25, help='lognormal sigma of both tiers')
+    parser.add_argument('--stall-share', type=float, default=0.03, help='share of calls that stall')
+    parser.add_argument('--stall', type=float, default=3.0, help='seconds a stalled call takes')
+    parser.add_argument('--tps', type=float, default=200, help='"main" tokens/sec after the first ("fast" gets 2x)')
+    parser.add_argument('--hedge-percentile', type=float, default=95)
+    parser.add_argument('--min-samples', type=int, default=20, help='calls per tier before hedging kicks in')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    app, chats = setup_app(args.users)
+    logging.getLogger('chatbot').setLevel(logging.ERROR)
+
+    print(f"{args.users} users x {args.turns} turns ({args.warmup} warmup), {args.trivial_share:.0%} trivial, "
+          f"stalls: {args.stall_share:.0%} x {args.stall:g}s\n")
+    print(f"{'configuration':16s} {'p50 ms':>8s} {'p95 ms':>8s} {'p99 ms':>8s} {'max ms':>8s} {'turns/s':>8s} "
+          f"{'errors':>6s}  turns per tier (incl. warmup) / hedges")
+    for config in ('single tier', 'routed', 'routed + hedged'):
+        r = run_config(app, chats, config, args)
+        print(f"{config:16s} {r['p50'] * 1000:8.0f} {r['p95'] * 1000:8.0f} {r['p99'] * 1000:8.0f} "
+              f"{r['max'] * 1000:8.0f} {r['turns/s']:8.1f} {r['errors']:6d}  "
+              f"{json.dumps(r['tiers'])} hedges {r['hedges']['fired']} fired / {r['hedges']['won']} won")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""
+Cold-start cost of a fresh worker: time to import the app, to serve its first request
+(deferred schema setup + sweeper start) and to answer its first chat (tokenizer, langchain import, LLM
+client, persona load), next to a warm chat for reference. With --prewarm the worker loads the tokenizer and
+builds the LLM client in the background after its first request and the first chat comes --idle seconds later.
+
+Every run is a new Python process on a throwaway SQLite database, so nothing is cached between runs.
+The stub LLM answers instantly; with --backend openai the client is built for real (its replies will
+fail without a key/network, which still shows the import and construction cost).
+
+Usage (from the repo root):
+    python benchmarks/bench_startup.py
+    python benchmarks/bench_startup.py --runs 10 --backend openai
+    python benchmarks/bench_startup.py --prewarm --idle 2
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PHASES = ['import', 'first_request', 'first_chat', 'warm_chat']
+
+
+def child(idle):
+    """One cold start; prints {phase: seconds} as JSON."""
+    sys.path.insert(0, ROOT)
+    timings = {}
+
+    start = time.perf_counter()
+    from app import app
+    timings['import'] = time.perf_counter() - start
+    modules = sorted(m for m in ('langchain', 'langchain_openai', 'openai', 'tiktoken') if m in sys.modules)
+
+    client = app.test_client()
+    start = time.perf_counter()
+    client.get('/login')
+    timings['first_request'] = time.perf_counter() - start
+
+    from models import db, User, ChatData, replace_examples
+    with app.app_context():
+        user = User(username='bench', email='bench@x')
+        user.set_password('pw')
+        db.session.add(user)
+        db.session.flush()
+        chat = ChatData(user_id=user.id, selected_person='Ali', all_messages='', is_temp=False)
+        db.session.add(chat)
+        db.session.flush()
+        replace_examples(chat.id, [f'example message {i} kya haal hai' for i in range(300)])
+        db.session.commit()
+        chat_id = chat.id
+    client.post('/login', data={'username': 'bench', 'password': 'pw'})
+    time.sleep(idle)
+
+    for phase, message in (('first_chat', 'kya haal hai'), ('warm_chat', 'kal class hai?')):
+        start = time.perf_counter()
+        client.post(f'/api/chat/{chat_id}', json={'message': message})
+        timings[phase] = time.perf_counter() - start
+
+    print(json.dumps({'timings': timings, 'loaded_at_import': modules}))
+
+
+def run_once(backend, prewarm, idle):
+    tmpdir = tempfile.mkdtemp(prefix='botme-startup-')
+    env = dict(
+        os.environ,
+        DATABASE_URL=f"sqlite:///{os.path.join(tmpdir, 'bench.db')}",
+        LLM_BACKEND=backend,
+        STUB_LLM_LATENCY='0',
+        STUB_LLM_TOKENS_PER_SEC='0',
+        TEMP_SWEEP_INTERVAL='0',
+        LLM_PREWARM='1' if prewarm else '0',
+        OPENAI_API_KEY=os.environ.get('OPENAI_API_KEY', 'sk-bench'),
+    )
+    out = subprocess.run([sys.executable, '-W', 'ignore', os.path.abspath(__file__), '--child',
+                          '--idle', str(idle)],
+                         env=env, cwd=tmpdir, capture_output=True, text=True, check=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Import, first-request and first-chat latency of a fresh worker.')
+    parser.add_argument('--runs', type=int, default=5, help='fresh processes to start')
+    parser.add_argument('--backend', default='stub', help='LLM_BACKEND for the runs')
+    parser.add_argument('--prewarm', action='store_true', help='let the worker build the LLM client in the background')
+    parser.add_argument('--idle', type=float, default=0, help='seconds between the first request and the first chat')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(args.idle)
+        return
+
+    results = [run_once(args.backend, args.prewarm, args.idle) for _ in range(args.runs)]
+    print(f"{args.runs} cold starts, backend={args.backend}, prewarm={'on' if args.prewarm else 'off'}, "
+          f"idle={args.idle:g}s")
+    print(f"loaded at import: {', '.join(results[0]['loaded_at_import']) or 'no LLM/tokenizer modules'}\n")
+    print(f"{'phase':14s} {'median ms':>10s} {'min ms':>8s} {'max ms':>8s}")
+    for phase in PHASES:
+        values = sorted(r['timings'][phase] for r in results)
+        print(f"{phase:14s} {values[len(values) // 2] * 1000:10.1f} {values[0] * 1000:8.1f} {values[-1] * 1000:8.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,182 @@
+"""
+Offline load test: many simulated users driving /upload (+ job polling), /select_person and /api/chat/<id>.
+
+By default the app runs in-process on a temporary SQLite database with the stub LLM backend,
+so no network or OpenAI key is needed. Reports p50/p95/p99 latency and requests/sec per endpoint.
+
+Usage (from the repo root):
+    python benchmarks/load_test.py
+    python benchmarks/load_test.py --users 50 --messages 10 --llm-latency 0.8 --llm-tps 40
+    python benchmarks/load_test.py --url http://127.0.0.1:5000   # hit an already running server
+"""
+import argparse
+import http.cookiejar
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench_parse import make_export
+from metrics import percentile
+
+USER_INPUTS = ['kya haal hai', 'kal class hai?', 'ok 😂', 'notes bhej do yaar', 'kahan ho?']
+
+
+class Recorder:
+    """Thread-safe latency log per endpoint name."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def add(self, name, seconds, ok=True):
+        with self.lock:
+            self.samples[name].append(seconds)
+            if not ok:
+                self.errors[name] += 1
+
+    def report(self, wall_seconds):
+        print(f"\n{'endpoint':16s} {'count':>6s} {'errors':>6s} {'p50 ms':>9s} {'p95 ms':>9s} "
+              f"{'p99 ms':>9s} {'req/s':>8s}")
+        for name in sorted(self.samples):
+            values = sorted(self.samples[name])
+            print(f"{name:16s} {len(values):6d} {self.errors[name]:6d} "
+                  f"{percentile(values, 50) * 1000:9.1f} {percentile(values, 95) * 1000:9.1f} "
+                  f"{percentile(values, 99) * 1000:9.1f} {len(values) / wall_seconds:8.1f}")
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class SimUser:
+    """One simulated browser session (own cookie jar) against the app."""
+
+    def __init__(self, base_url, recorder):
+        self.base_url = base_url.rstrip('/')
+        self.recorder = recorder
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), _NoRedirect()
+        )
+
+    def request(self, name, path, data=None, headers=None, record=True):
+        req = urllib.request.Request(self.base_url + path, data=data, headers=headers or {})
+        start = time.perf_counter()
+        try:
+            resp = self.opener.open(req, timeout=120)
+            status, location, body = resp.status, resp.headers.get('Location'), resp.read()
+        except urllib.error.HTTPError as e:
+            status, location, body = e.code, e.headers.get('Location'), e.read()
+        except (urllib.error.URLError, OSError):
+            status, location, body = 0, None, b''
+        elapsed = time.perf_counter() - start
+        if record:
+            self.recorder.add(name, elapsed, ok=200 <= status < 400)
+        return status, location, body
+
+    def form(self, name, path, fields, record=True):
+        data = urllib.parse.urlencode(fields).encode()
+        return self.request(name, path, data, {'Content-Type': 'application/x-www-form-urlencoded'}, record)
+
+    def run(self, export_text, n_messages):
+        username = f"bench-{uuid.uuid4().hex[:10]}"
+        self.form('signup', '/signup', {'username': username, 'email': f'{username}@x', 'password': 'pw'},
+                  record=False)
+        self.form('login', '/login', {'username': username, 'password': 'pw'}, record=False)
+
+        boundary = uuid.uuid4().hex
+        body = (
+            f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="chat.txt"\r\n'
+            f'Content-Type: text/plain\r\n\r\n'
+        ).encode() + export_text.encode('utf-8') + f'\r\n--{boundary}--\r\n'.encode()
+        start = time.perf_counter()
+        status, _, resp_body = self.request(
+            'upload', '/upload', body,
+            {'Content-Type': f'multipart/form-data; boundary={boundary}', 'Accept': 'application/json'}
+        )
+        if status != 202:
+            return
+
+        # Poll the background parse job like the dashboard does
+        status_url = json.loads(resp_body)['status_url']
+        while True:
+            status, _, resp_body = self.request('upload_status', status_url, headers={'Accept': 'application/json'})
+            job = json.loads(resp_body) if status == 200 else {'status': 'failed'}
+            if job['status'] != 'queued':
+                break
+            time.sleep(0.05)
+        self.recorder.add('upload_to_ready', time.perf_counter() - start, ok=job['status'] == 'ready')
+        if job['status'] != 'ready':
+            return
+        query = urllib.parse.parse_qs(urllib.parse.urlparse(job['select_url']).query)
+        chat_id = query['chat_id'][0]
+
+        self.request('select_page', f'/select_person?chat_id={chat_id}')
+        self.form('select_person', '/select_person', {'person': 'Ali Khan', 'chat_id': chat_id})
+
+        for i in range(n_messages):
+            payload = json.dumps({'message': USER_INPUTS[i % len(USER_INPUTS)]}).encode()
+            self.request('api_chat', f'/api/chat/{chat_id}', payload, {'Content-Type': 'application/json'})
+
+
+def start_local_server(args):
+    """Run the app in a background thread on a throwaway DB with the stub LLM; returns its base URL."""
+    tmpdir = tempfile.mkdtemp(prefix='botme-bench-')
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tmpdir, 'bench.db')}"
+    os.environ['LLM_BACKEND'] = 'stub'
+    os.environ['STUB_LLM_LATENCY'] = str(args.llm_latency)
+    os.environ['STUB_LLM_TOKENS_PER_SEC'] = str(args.llm_tps)
+
+    from werkzeug.serving import make_server
+    from app import app
+
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)  # no per-request access log
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline load test for the BotMe Flask app.')
+    parser.add_argument('--url', help='target an already running server instead of starting one')
+    parser.add_argument('--users', type=int, default=20, help='concurrent simulated users')
+    parser.add_argument('--messages', type=int, default=5, help='chat messages per user')
+    parser.add_argument('--export-lines', type=int, default=5000, help='lines in each uploaded export')
+    parser.add_argument('--llm-latency', type=float, default=0.3, help='stub LLM seconds to first token')
+    parser.add_argument('--llm-tps', type=float, default=100, help='stub LLM tokens/sec')
+    args = parser.parse_args()
+
+    base_url = args.url or start_local_server(args)
+    export_text = make_export('ios', args.export_lines).getvalue()
+    print(f"{args.users} users x {args.messages} messages against {base_url} "
+          f"({len(export_text) / 1024:.0f} KB export)")
+
+    recorder = Recorder()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.users) as pool:
+        futures = [pool.submit(SimUser(base_url, recorder).run, export_text, args.messages)
+                   for _ in range(args.users)]
+        for future in futures:
+            future.result()
+    wall = time.perf_counter() - start
+
+    recorder.report(wall)
+    print(f"\nwall time {wall:.2f}s")
+
+
+if __name__ == '__main__':
+    main()
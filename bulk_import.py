@@ -0,0 +1,257 @@
+import io
+import logging
+import os
+import threading
+import time
+import zipfile
+from concurrent.futures import as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+from config import Config
+from models import (db, ChatData, UploadJob, BulkImportFile, BulkPersona, save_participant_blobs,
+                    load_participants, load_participant_messages, drop_participant_blobs, replace_examples,
+                    save_profile)
+from parse_chat import parse_chat_file
+from style_profile import build_style_profile, clean_messages
+from jobs import encode_participants, get_executor, reset_executor, fail_job, remove_file, save_upload
+from metrics import STAGE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+class ImportReport:
+    """Counts and timings of one bulk import, for the CLI output and the log."""
+
+    def __init__(self):
+        self.files = 0
+        self.failed = 0
+        self.bytes = 0
+        self.parse_seconds = 0.0
+        self.personas = 0
+        self.persona_seconds = 0.0
+
+    def summary(self):
+        mb = self.bytes / 1e6
+        parse_s = self.parse_seconds or 1e-9
+        lines = [
+            f"Parsed {self.files} files ({self.failed} failed), {mb:.1f} MB in {self.parse_seconds:.2f}s: "
+            f"{self.files / parse_s:.1f} files/sec, {mb / parse_s:.2f} MB/sec"
+        ]
+        if self.personas:
+            lines.append(f"Created {self.personas} personas in {self.persona_seconds:.2f}s: "
+                         f"{self.personas / (self.persona_seconds or 1e-9):.1f} personas/sec")
+        return "\n".join(lines)
+
+
+def list_archive_exports(path, max_files=None, max_bytes=None):
+    """
+    Names of the .txt chat exports inside a zip (folders and macOS "._" files skipped).
+    Raises ValueError if the archive has none or is over the file-count / uncompressed-size limits.
+    """
+    with zipfile.ZipFile(path) as zf:
+        members = [info for info in zf.infolist()
+                   if not info.is_dir()
+                   and info.filename.lower().endswith('.txt')
+                   and not info.filename.startswith('__MACOSX/')
+                   and not os.path.basename(info.filename).startswith('._')]
+    if not members:
+        raise ValueError("No .txt chat exports found in the archive.")
+    if max_files and len(members) > max_files:
+        raise ValueError(f"Archive has {len(members)} exports; the limit is {max_files}.")
+    if max_bytes and sum(info.file_size for info in members) > max_bytes:
+        raise ValueError(f"Archive unpacks to more than {max_bytes / 1e6:.0f} MB.")
+    return [info.filename for info in members]
+
+
+def parse_archive_member(path, member):
+    """
+    Worker: parse one export straight out of the zip (nothing is extracted to disk).
+    Returns (member, uncompressed bytes, participant blobs or None, error or None).
+    Every participant is kept, not just the top two.
+    """
+    with zipfile.ZipFile(path) as zf:
+        info = zf.getinfo(member)
+        try:
+            with zf.open(info) as raw:
+                parsed = parse_chat_file(io.TextIOWrapper(raw, encoding='utf-8-sig', errors='replace'))
+        except (ValueError, IndexError, UnicodeDecodeError) as e:
+            return member, info.file_size, None, str(e)
+    return member, info.file_size, encode_participants(parsed['messages_by_person']), None
+
+
+def _store_parsed(user_id, job_id, results, report):
+    """Write one batch of parse results (temp chats + blobs + file rows) in a single transaction."""
+    for member, size, blobs, error in results:
+        report.files += 1
+        report.bytes += size
+        chat_id = None
+        if blobs:
+            chat = ChatData(user_id=user_id, selected_person=None, all_messages='',
+                            messages='[]', conversation_history='[]', is_temp=True)
+            db.session.add(chat)
+            db.session.flush()
+            save_participant_blobs(chat.id, blobs)
+            chat_id = chat.id
+        else:
+            report.failed += 1
+        db.session.add(BulkImportFile(job_id=job_id, filename=member[:255], size_bytes=size,
+                                      chat_id=chat_id, error=error))
+    db.session.commit()
+
+
+def import_archive(executor, user_id, job_id, path, batch_size=50):
+    """
+    Parse every export in the zip on `executor` (a process pool) and store each one as a temp chat
+    with all its participants, committing batch_size files per transaction. Returns an ImportReport.
+    """
+    members = list_archive_exports(path, Config.BULK_MAX_FILES, Config.BULK_MAX_BYTES)
+    report = ImportReport()
+    start = time.perf_counter()
+    futures = [executor.submit(parse_archive_member, path, member) for member in members]
+    batch = []
+    for future in as_completed(futures):
+        batch.append(future.result())
+        if len(batch) >= batch_size:
+            _store_parsed(user_id, job_id, batch, report)
+            batch = []
+    if batch:
+        _store_parsed(user_id, job_id, batch, report)
+    report.parse_seconds = time.perf_counter() - start
+    STAGE_SECONDS.observe(report.parse_seconds, stage='bulk_parse')
+    return report
+
+
+def create_personas(user_id, selections, batch_size=50, report=None):
+    """
+    Turn [(temp chat id, participant name)] into ready ChatData personas (cleaned examples + style profile),
+    committing every batch_size personas. Selections without usable messages are skipped.
+    Returns the new chats as [(chat id, participant name)].
+    """
+    start = time.perf_counter()
+    created = []
+    for source_id, name in selections:
+        msgs = load_participant_messages(source_id, name)
+        example_msgs = clean_messages(msgs)
+        if not example_msgs:
+            continue
+        chat = ChatData(user_id=user_id, selected_person=name, all_messages='',
+                        messages='[]', conversation_history='[]', is_temp=False)
+        db.session.add(chat)
+        db.session.flush()
+        replace_examples(chat.id, example_msgs)
+        save_profile(chat.id, build_style_profile(msgs, n_examples=Config.STYLE_CURATED_EXAMPLES))
+        created.append((chat.id, name))
+        if len(created) % batch_size == 0:
+            db.session.commit()
+    db.session.commit()
+    if report is not None:
+        report.personas += len(created)
+        report.persona_seconds += time.perf_counter() - start
+    STAGE_SECONDS.observe(time.perf_counter() - start, stage='bulk_personas')
+    return created
+
+
+def discard_sources(chat_ids):
+    """Delete the temp chats (and their blobs) once personas were built from them."""
+    if not chat_ids:
+        return
+    chat_ids = list(chat_ids)
+    db.session.execute(db.update(BulkImportFile).where(BulkImportFile.chat_id.in_(chat_ids)).values(chat_id=None))
+    drop_participant_blobs(chat_ids)
+    db.session.execute(db.delete(ChatData).where(ChatData.id.in_(chat_ids), ChatData.is_temp.is_(True)))
+    db.session.commit()
+
+
+def job_files(job_id):
+    """[(BulkImportFile, participants)] of a bulk job, participants most active first."""
+    files = BulkImportFile.query.filter_by(job_id=job_id).order_by(BulkImportFile.filename).all()
+    return [(f, load_participants(f.chat_id) if f.chat_id else []) for f in files]
+
+
+def job_personas(job_id):
+    """[(chat id, name)] of the bots built from a bulk job, empty until they're all ready."""
+    rows = BulkPersona.query.filter_by(job_id=job_id).order_by(BulkPersona.id).all()
+    return [(row.chat_id, row.name) for row in rows]
+
+
+def _run_bulk_job(app, job_id, user_id, path):
+    """Background import of a saved zip. Whatever goes wrong, the job leaves 'queued' and the zip is removed."""
+    with app.app_context():
+        try:
+            try:
+                report = import_archive(get_executor(app), user_id, job_id, path, Config.BULK_BATCH_SIZE)
+            except BrokenProcessPool:
+                # A worker died (e.g. killed for memory); start a fresh pool and try once more
+                reset_executor()
+                discard_sources([f.chat_id for f in BulkImportFile.query.filter_by(job_id=job_id) if f.chat_id])
+                BulkImportFile.query.filter_by(job_id=job_id).delete()
+                db.session.commit()
+                report = import_archive(get_executor(app), user_id, job_id, path, Config.BULK_BATCH_SIZE)
+            job = db.session.get(UploadJob, job_id)
+            if job is None:
+                return  # swept while we were importing
+            if report.files == report.failed:
+                job.status = 'failed'
+                job.error = "None of the exports in the archive could be parsed."
+            else:
+                job.status = 'ready'
+            db.session.commit()
+            logger.info("Bulk import %s: %s", job_id, report.summary())
+        except (ValueError, zipfile.BadZipFile) as e:
+            fail_job(job_id, f"Error reading archive: {e}")
+        except Exception as e:
+            logger.exception("Bulk import %s failed", job_id)
+            fail_job(job_id, f"An unexpected error occurred: {e}")
+        finally:
+            remove_file(path)
+            db.session.remove()
+
+
+def submit_bulk_upload(app, user_id, file_storage):
+    """
+    Save an uploaded zip and import it in the background. Returns the UploadJob id right away;
+    the job is 'ready' (with no chat_id) once every export is parsed into temp chats.
+    """
+    job_id, path = save_upload(app, user_id, file_storage, '.zip')
+    # The coordinating thread only waits on the pool and writes batches; parsing runs in the worker processes
+    threading.Thread(target=_run_bulk_job, args=(app, job_id, user_id, path),
+                     name=f'bulk-import-{job_id[:8]}', daemon=True).start()
+    return job_id
+
+
+def _run_persona_job(app, job_id, user_id, selections, source_ids):
+    """Background half of submit_personas: build the bots, list them on the job, then drop the temp chats."""
+    with app.app_context():
+        try:
+            created = create_personas(user_id, selections, Config.BULK_BATCH_SIZE)
+            job = db.session.get(UploadJob, job_id)
+            if job is None:
+                return
+            db.session.add_all(BulkPersona(job_id=job_id, chat_id=chat_id, name=name[:255])
+                               for chat_id, name in created)
+            job.status = 'ready'
+            db.session.commit()
+            discard_sources(source_ids)
+        except Exception as e:
+            logger.exception("Creating personas for bulk import %s failed", job_id)
+            fail_job(job_id, f"Creating the bots failed: {e}")
+        finally:
+            db.session.remove()
+
+
+def submit_personas(app, job, selections, source_ids):
+    """
+    Build the selected participants of a ready bulk job in the background (cleaning, example inserts and
+    a style profile each, for up to BULK_MAX_FILES exports), so the request doesn't wait for them.
+    The job goes back to 'queued' until they're done; job_personas lists them after that.
+    Returns False if the job wasn't 'ready' any more (e.g. the form was posted twice).
+    """
+    claimed = db.session.execute(
+        db.update(UploadJob).where(UploadJob.id == job.id, UploadJob.status == 'ready').values(status='queued')
+    ).rowcount
+    db.session.commit()
+    if not claimed:
+        return False
+    threading.Thread(target=_run_persona_job, args=(app, job.id, job.user_id, selections, source_ids),
+                     name=f'bulk-personas-{job.id[:8]}', daemon=True).start()
+    return True
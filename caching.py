@@ -0,0 +1,233 @@
+import hashlib
+import random
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from retrieval import char_ngrams
+from routing import is_trivial
+from text_patterns import EMOJI_RE, squash_repeats
+
+
+class LRUCache:
+    """
+    Small thread-safe in-process cache with LRU size eviction and a per-entry TTL.
+    maxsize: max number of entries kept (least recently used are dropped first)
+    ttl: seconds an entry stays valid after it was stored (None = never expires)
+    sliding: if True, every get() restarts the ttl, so only idle entries expire
+    """
+
+    def __init__(self, maxsize=128, ttl=None, sliding=False):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.sliding = sliding
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _expired(self, expires_at):
+        return expires_at is not None and expires_at < time.monotonic()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or self._expired(item[0]):
+                if item is not None:
+                    del self._data[key]
+                self.misses += 1
+                return default
+            if self.sliding and self.ttl:
+                self._data[key] = (time.monotonic() + self.ttl, item[1])
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def peek(self, key, default=None):
+        """Like get, but doesn't touch LRU order or hit counters."""
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or self._expired(item[0]):
+                return default
+            return item[1]
+
+    def set(self, key, value):
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            item = self._data.pop(key, None)
+            return default if item is None else item[1]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return self.peek(key) is not None
+
+
+_word_re = re.compile(r'\w+', re.UNICODE)
+
+
+def normalize_input(text):
+    """Lowercase, squash repeated letters, drop punctuation: "Kya haaal hai??" -> "kya hal hai"."""
+    text = squash_repeats(text)
+    return ' '.join(_word_re.findall(text) + EMOJI_RE.findall(text))
+
+
+def _jaccard(a, b):
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+class ResponseCache:
+    """
+    Cache of chat replies per persona, keyed on (chat_id, history fingerprint, normalized input).
+    Each entry keeps up to `variants` different replies; a lookup is only answered from the cache with
+    probability (replies stored / variants), so the first repeats still go to the LLM and fill the variant
+    pool, and answers are then picked at random from it.
+    Short trivial inputs (see routing.is_trivial, up to `fuzzy_max_words` words) that aren't an exact
+    normalized match can still hit when their character n-grams overlap by at least `fuzzy_threshold`
+    (Jaccard; 0 disables fuzzy matching). Longer inputs only hit exactly: one changed word ("nahi", "tujhe")
+    barely moves the n-gram overlap of a sentence but flips its meaning.
+    Evicts least recently used entries beyond `maxsize` entries or `max_bytes` of text, and after `ttl` seconds.
+    """
+
+    def __init__(self, maxsize=10000, ttl=3600, max_bytes=16 * 1024 * 1024, variants=3, fuzzy_threshold=0.9,
+                 fuzzy_max_words=3, rng=random):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.variants = max(1, variants)
+        self.fuzzy_threshold = fuzzy_threshold
+        self.fuzzy_max_words = fuzzy_max_words
+        self.rng = rng
+        self._entries = OrderedDict()  # (chat_id, fingerprint, input) -> entry dict
+        self._buckets = {}  # (chat_id, fingerprint) -> set of normalized inputs, for the fuzzy scan
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def fingerprint(history, turns=1):
+        """
+        Short hash of the user's last `turns` messages, so "ok" after "kal milte hain" and "ok" after
+        "exam fail ho gaya" are different keys. The persona's replies are left out: they're LLM output and
+        almost never repeat, so keying on them would only ever hit on a conversation's first turn.
+        """
+        if turns <= 0 or not history:
+            return ''
+        user_messages = [msg for msg in history if msg['role'] == 'user'][-turns:]
+        if not user_messages:
+            return ''
+        tail = '\n'.join(normalize_input(msg['content']) for msg in user_messages)
+        return hashlib.blake2b(tail.encode('utf-8'), digest_size=8).hexdigest()
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self._bytes -= entry['size']
+        bucket = self._buckets.get(key[:2])
+        if bucket is not None:
+            bucket.discard(key[2])
+            if not bucket:
+                del self._buckets[key[:2]]
+
+    def _find(self, chat_id, fp, norm, fuzzy):
+        """Return (key, match kind) of a live entry for this input, or (None, None)."""
+        key = (chat_id, fp, norm)
+        now = time.monotonic()
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry['expires_at'] >= now:
+                return key, 'exact'
+            self._remove(key)
+        if not fuzzy or not self.fuzzy_threshold:
+            return None, None
+
+        grams = set(char_ngrams(norm))
+        best, best_score = None, self.fuzzy_threshold
+        for other in list(self._buckets.get((chat_id, fp), ())):
+            other_key = (chat_id, fp, other)
+            other_entry = self._entries[other_key]
+            if other_entry['expires_at'] < now:
+                self._remove(other_key)
+                continue
+            score = _jaccard(grams, other_entry['grams'])
+            if score >= best_score:
+                best, best_score = other_key, score
+        return (best, 'fuzzy') if best else (None, None)
+
+    def get(self, chat_id, fp, user_input):
+        """
+        Return (reply, match kind, seconds the original LLM call took) or (None, 'miss', 0).
+        A matching entry that still has room for more variants may deliberately miss.
+        """
+        norm = normalize_input(user_input)
+        if not norm:
+            return None, 'miss', 0
+        with self._lock:
+            key, kind = self._find(chat_id, fp, norm, is_trivial(user_input, self.fuzzy_max_words))
+            if key is None:
+                return None, 'miss', 0
+            entry = self._entries[key]
+            if self.rng.random() >= len(entry['replies']) / self.variants:
+                return None, 'miss', 0
+            self._entries.move_to_end(key)
+            return self.rng.choice(entry['replies']), kind, entry['llm_seconds']
+
+    def add(self, chat_id, fp, user_input, reply, llm_seconds=0.0):
+        """Store an LLM reply as one more variant for this input (replies already stored are ignored)."""
+        norm = normalize_input(user_input)
+        if not norm or not reply:
+            return
+        key = (chat_id, fp, norm)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = {
+                    'grams': set(char_ngrams(norm)), 'replies': [], 'llm_seconds': 0.0,
+                    'size': len(norm.encode('utf-8')), 'expires_at': 0,
+                }
+                self._bytes += entry['size']
+                self._buckets.setdefault(key[:2], set()).add(norm)
+            if reply not in entry['replies'] and len(entry['replies']) < self.variants:
+                entry['replies'].append(reply)
+                size = len(reply.encode('utf-8'))
+                entry['size'] += size
+                self._bytes += size
+                # running mean of what a call for this input costs, for the "seconds saved" metric
+                n = len(entry['replies'])
+                entry['llm_seconds'] += (llm_seconds - entry['llm_seconds']) / n
+            entry['expires_at'] = time.monotonic() + self.ttl if self.ttl else float('inf')
+            self._entries.move_to_end(key)
+            while self._entries and (len(self._entries) > self.maxsize or self._bytes > self.max_bytes):
+                self._remove(next(iter(self._entries)))
+
+    def invalidate(self, chat_id):
+        """Drop every entry of one chat (persona changed or deleted)."""
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == chat_id]:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._buckets.clear()
+            self._bytes = 0
+
+    @property
+    def size_bytes(self):
+        return self._bytes
+
+    def __len__(self):
+        return len(self._entries)
@@ -1,15 +1,27 @@
-from langchain_openai import ChatOpenAI
 # from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain.prompts import PromptTemplate
-from langchain.chains import ConversationChain
-from langchain.memory import ConversationBufferMemory
-import json
-import random  # For sampling examples if needed
+from flask import current_app
+from sqlalchemy import event, inspect
+from sqlalchemy.exc import IntegrityError
+import copy
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from config import Config
-from models import ChatData, db  # Import for DB access to update history
+from models import (ChatData, db, load_examples, load_history, append_turns, load_summary, save_summary,
+                    load_profile, save_profile)
+from style_profile import build_style_profile, format_style_profile
+from retrieval import StyleIndex
+from caching import LRUCache, ResponseCache
+from token_budget import PromptBudget, count_tokens, fit_to_budget, truncate_to_tokens, prewarm_tokenizer
+from llm_executor import LLMSaturated, LLMTimeout
+from routing import get_router
+from metrics import span, record_request_value, Counter, PROMPT_TOKENS, CHAT_TURNS, STAGE_SECONDS
+import logging
+import time
 
-# Initialize LLM (fix: use gpt-4o; set your API key in config.py)
-llm = ChatOpenAI(model="gpt-4o", temperature=0.7, openai_api_key=Config.OPENAI_API_KEY)
+logger = logging.getLogger(__name__)
+
+# LLM calls go through routing.get_router(): it picks the model tier per turn and hedges slow calls.
+# The clients ("openai" by default, "stub" for offline runs) are built on first use, not at import
 
 """llm = ChatGoogleGenerativeAI(
     model="gemini-1.0-pro", 
@@ -18,116 +30,544 @@ llm = ChatOpenAI(model="gpt-4o", temperature=0.7, openai_api_key=Config.OPENAI_A
 )
 """
 
-def create_chatbot_prompt(selected_person, person_msgs):
+def format_examples(selected_person, person_msgs):
+    """Format style examples as "Person's response: {msg}" lines for the prompt."""
+    return [f"{selected_person}'s response: {msg}" for msg in person_msgs]
+
+
+def _escape_braces(text):
+    # Braces are doubled so PromptTemplate doesn't treat them as variables
+    return text.replace('{', '{{').replace('}', '}}')
+
+
+def create_chatbot_prompt(selected_person, profile=None):
     """
     Create a high-quality prompt to emulate a person's personality, tone, and style in Roman Urdu.
-    person_msgs: list of str (person's messages for examples)
-    Limit to 100 examples to avoid token limits; sample if more for diversity.
-    """
-    # Use up to 100 examples: random sample for better coverage of "whole" style
-    # if len(person_msgs) > 500:
-    #     person_msgs_sample = random.sample(person_msgs, 500)
-    # else:
-    #     person_msgs_sample = person_msgs[:500]
-    person_msgs_sample=person_msgs[::]
-    
-    # Format examples as "Person's response: {msg}" for clarity
-    examples = "\n".join([f"{selected_person}'s response: {msg}" for msg in person_msgs_sample])
+    The template is compiled once per persona: the style profile and its curated examples are baked in,
+    {examples} (retrieved for the input), {history} and {input} are filled per turn.
+    """
+    person = _escape_braces(selected_person)
+
+    style = ""
+    if profile:
+        traits = _escape_braces(format_style_profile(profile)).replace("\n", "\n    ")
+        curated = _escape_braces("\n    ".join(format_examples(selected_person, profile['examples'])))
+        style = f"""
+    Style profile of {person}:
+    {traits}
+
+    Typical messages by {person}:
+    {curated}
+"""
 
     template = f"""
-    You are a chatbot designed to perfectly emulate the personality, tone, humor, and style of {selected_person} 
+    You are a chatbot designed to perfectly emulate the personality, tone, humor, and style of {person} 
     based on their chat history written in Roman Urdu.
-
+{style}
     Study these examples carefully to capture their unique manner of speaking, casual phrasing, slang, and emotional tone:
 
-    {examples}
+    {{examples}}
 
     Memory of past conversation: {{history}}
 
     Instructions for behavior:
-    - Always respond in the style of {selected_person} in Roman Urdu.
+    - Always respond in the style of {person} in Roman Urdu.
     - Use casual, friendly, and natural language; include local slang, short forms, and emojis as seen in their messages.
     - Match their vocabulary, sentence structure, humor, and emotional tone.
-    - Maintain continuity across messages; remember context from {{history}}.
+    - Maintain continuity across messages; remember context from the conversation above.
     - Responses should be concise, engaging, and under 100 words.
     - Never break character, switch to English fully, or reference being a chatbot.
 
     Human: {{input}}
-    {selected_person}:
+    {person}:
     """
     # Note: End with "{selected_person}:" to prompt the model to respond in character
 
-    prompt = PromptTemplate(input_variables=["input", "history"], template=template)
+    # langchain is only imported once a persona is actually loaded (keeps it off the app import path)
+    from langchain.prompts import PromptTemplate
+    prompt = PromptTemplate(input_variables=["examples", "input", "history"], template=template)
     return prompt
 
-def get_chatbot_response(chat_data_id, user_input):
+def prewarm_llm():
     """
-    Generate response using stored chat data.
-    Loads example messages (list of str) and persistent history (list of dicts) from DB.
-    Updates history in DB after response.
+    Load the tokenizer, import the prompt classes and build the LLM clients ahead of the first chat.
+    Run from a background thread after startup; failures are left for the first real chat to report.
     """
-    chat_data = ChatData.query.get(chat_data_id)
+    try:
+        prewarm_tokenizer()
+        from langchain.prompts import PromptTemplate  # noqa: F401
+        get_router().prewarm()
+    except Exception:
+        logger.exception("LLM prewarm failed")
+
+
+class ChatbotError(Exception):
+    """Raised when a chat can't be answered (missing data); the message is shown to the user."""
+
+
+class ChatNotFound(ChatbotError):
+    """The chat doesn't exist or belongs to another user (routes answer 404)."""
+
+
+class PersonaSession:
+    """
+    Everything needed to answer a turn for one chat, kept between requests:
+    decoded examples + their StyleIndex, the compiled prompt (with the style profile), the running summary
+    and recent history.
+    """
+
+    def __init__(self, chat_id, selected_person, person_msgs, history, next_seq, summary='', covered_seq=-1,
+                 profile=None, user_id=None):
+        self.chat_id = chat_id
+        self.user_id = user_id  # owner, checked on every cache hit
+        self.selected_person = selected_person
+        # Curated examples are always in the prompt, so retrieval only draws from the rest
+        curated = set(profile['examples']) if profile else set()
+        self.style_index = StyleIndex([msg for msg in person_msgs if msg not in curated] or person_msgs)
+        self.prompt = create_chatbot_prompt(selected_person, profile)
+        self.budget = PromptBudget()
+        # Instructions cost the same every turn, so count them once
+        self.fixed_tokens = count_tokens(self.prompt.format(examples='', history='', input=''))
+        self.history = [dict(msg, tokens=count_tokens(msg["content"])) for msg in history]
+        self.summary = summary
+        self.covered_seq = covered_seq  # last seq already folded into the summary
+        self.folding = []  # messages being summarized in the background; still rendered until that lands
+        self.next_seq = next_seq  # seq number of the next ConversationTurn row
+        self.lock = threading.Lock()
+
+    def render_history(self):
+        """Running summary + the recent turns that fit the history budget, as plain "Speaker: text" lines."""
+        lines = []
+        if self.summary:
+            lines.append(f"(Summary of earlier conversation: {self.summary})")
+        for msg in self.budget.fit_history(self.folding + self.history):
+            speaker = "Human" if msg["role"] == "user" else self.selected_person
+            lines.append(f"{speaker}: {msg['content']}")
+        return "\n".join(lines)
+
+    def render_prompt(self, user_input):
+        """Render this turn's prompt text, with as many retrieved examples as the token budget allows."""
+        user_input = self.budget.fit_input(user_input)
+        # Only the examples relevant to this input (plus a few random ones) are candidates
+        candidates = self.style_index.select_examples(
+            user_input,
+            k=Config.STYLE_EXAMPLES_TOP_K,
+            n_diverse=Config.STYLE_EXAMPLES_DIVERSE,
+        )
+        with self.lock:
+            history = self.render_history()
+        examples_budget = self.budget.examples_budget(
+            self.fixed_tokens, count_tokens(history), count_tokens(user_input)
+        )
+        examples = fit_to_budget(format_examples(self.selected_person, candidates), examples_budget)
+        prompt_text = self.prompt.format(
+            examples="\n".join(examples),
+            input=user_input,
+            history=history,
+        )
+        prompt_tokens = count_tokens(prompt_text)
+        PROMPT_TOKENS.observe(prompt_tokens)
+        record_request_value('prompt_tokens', prompt_tokens)
+        return prompt_text
+
+    def record_turn(self, user_input, response):
+        """
+        Append a finished turn to the recent history.
+        Returns (rows to insert as [(seq, role, content)], old messages that must now be folded into the summary).
+        While an earlier fold is still running nothing new is folded (both would start from the same summary);
+        the history just stays over budget until the next turn.
+        """
+        with self.lock:
+            rows = [
+                (self.next_seq, "user", user_input),
+                (self.next_seq + 1, "assistant", response),
+            ]
+            self.next_seq += 2
+            for seq, role, content in rows:
+                self.history.append({"seq": seq, "role": role, "content": content, "tokens": count_tokens(content)})
+            if self.folding:
+                return rows, []
+            to_fold, self.history = self.budget.split_history(self.history)
+            self.folding = to_fold
+            return rows, to_fold
+
+    def apply_summary(self, summary, covered_seq):
+        with self.lock:
+            self.summary = summary
+            self.covered_seq = covered_seq
+            self.folding = []
+
+    def cancel_fold(self):
+        """Put the messages of a fold that didn't finish back into the history, to be folded next time."""
+        with self.lock:
+            self.history = self.folding + self.history
+            self.folding = []
+
+    def fork(self):
+        """A new conversation with the same persona: shares the examples, index and prompt, starts with no history."""
+        session = copy.copy(self)
+        session.history = []
+        session.summary = ''
+        session.covered_seq = -1
+        session.folding = []
+        session.next_seq = 0
+        session.lock = threading.Lock()
+        return session
+
+
+SUMMARY_PROMPT = """Progressively summarize the conversation between Human and {person}, adding onto the previous summary.
+Keep names, facts, plans and the emotional tone. Reply with the new summary only, in under {words} words.
+
+Previous summary:
+{summary}
+
+New lines of conversation:
+{lines}
+
+New summary:"""
+
+
+def summarize_history(selected_person, summary, messages):
+    """Fold messages into the running summary with one LLM call; falls back to plain text if the call fails."""
+    lines = "\n".join(
+        f"{'Human' if msg['role'] == 'user' else selected_person}: {msg['content']}" for msg in messages
+    )
+    router = get_router()
+    try:
+        result = router.invoke(SUMMARY_PROMPT.format(
+            person=selected_person,
+            words=Config.SUMMARY_MAX_TOKENS // 2,
+            summary=summary or "(none)",
+            lines=lines,
+        ), tier=router.cheapest())
+        new_summary = getattr(result, "content", result).strip()
+    except Exception:
+        logger.exception("Summarizing history failed; falling back to plain text")
+        new_summary = ""
+    if not new_summary:
+        # Keep the most recent text that fits rather than losing the context entirely
+        new_summary = f"{summary}\n{lines}".strip()[-Config.SUMMARY_MAX_TOKENS * 4:]
+    return truncate_to_tokens(new_summary, Config.SUMMARY_MAX_TOKENS)
+
+
+# chat_id -> PersonaSession; per process, so with several workers each keeps its own copy.
+# Sliding ttl: a chat someone is actively using keeps its (expensive to build) style index
+_persona_sessions = LRUCache(maxsize=Config.PERSONA_CACHE_SIZE, ttl=Config.PERSONA_CACHE_TTL, sliding=True)
+
+# Max unsummarized turns read when a session is (re)loaded
+HISTORY_LOAD_WINDOW = 50
+
+
+def _load_chat(chat_data_id, user_id=None):
+    """
+    Load a ChatData row plus its example messages (list of str), the recent history window
+    (list of dicts, next seq) and the style profile. Raises ChatbotError with a user-facing message
+    if the chat isn't usable. With user_id, the ownership check is part of the same query.
+    """
+    with span('chat_db_load'):
+        query = ChatData.query.filter_by(id=chat_data_id)
+        if user_id is not None:
+            query = query.filter_by(user_id=user_id)
+        chat_data = query.first()
     if not chat_data:
-        return "Error: Chat data not found."
+        raise ChatNotFound("Error: Chat data not found.")
     
     selected_person = chat_data.selected_person
     if not selected_person:
-        return "Error: No person selected for this chat."
+        raise ChatbotError("Error: No person selected for this chat.")
     
-    # Load person's example messages (JSON string -> list of str)
-    try:
-        person_msgs = json.loads(chat_data.messages)
-    except (json.JSONDecodeError, TypeError):
-        person_msgs = []
+    # Load person's example messages (ExampleMessage rows -> list of str)
+    with span('chat_db_load'):
+        person_msgs = load_examples(chat_data.id)
     
     if not person_msgs:
-        return f"Error: No example messages found for {selected_person}. Please upload a valid chat."
+        raise ChatbotError(f"Error: No example messages found for {selected_person}. Please upload a valid chat.")
+    
+    # Running summary + the turns after it (bounded read; the token budget trims further)
+    with span('chat_db_load'):
+        summary, covered_seq = load_summary(chat_data.id)
+        history, next_seq = load_history(chat_data.id, window=HISTORY_LOAD_WINDOW, after_seq=covered_seq)
+        profile = load_profile(chat_data.id)
+    
+    if profile is None:
+        # Chats selected before profiles existed: build it once from the stored examples
+        with span('select_profile'):
+            profile = build_style_profile(person_msgs, n_examples=Config.STYLE_CURATED_EXAMPLES)
+            save_profile(chat_data.id, profile)
+            try:
+                db.session.commit()
+            except IntegrityError:
+                # A concurrent first load saved the same profile already
+                db.session.rollback()
+    
+    return chat_data, person_msgs, history, next_seq, summary, covered_seq, profile
+
+
+def get_persona_session(chat_data_id, user_id=None):
+    """
+    Return the cached PersonaSession for a chat, loading it from the DB on a miss.
+    With user_id, raises ChatNotFound unless that user owns the chat (no query needed on a cache hit).
+    """
+    session = _persona_sessions.get(chat_data_id)
+    if session is None:
+        chat_data, person_msgs, history, next_seq, summary, covered_seq, profile = _load_chat(chat_data_id, user_id)
+        with span('chat_session_build'):
+            session = PersonaSession(chat_data.id, chat_data.selected_person, person_msgs, history, next_seq,
+                                     summary, covered_seq, profile, user_id=chat_data.user_id)
+        _persona_sessions.set(chat_data_id, session)
+    elif user_id is not None and session.user_id != user_id:
+        raise ChatNotFound("Error: Chat data not found.")
+    return session
+
+
+def warm_persona_session(chat_data_id):
+    """Build the session ahead of the first turn (e.g. right after a person is selected)."""
+    try:
+        get_persona_session(chat_data_id)
+    except ChatbotError:
+        pass
+
+
+def invalidate_persona_session(chat_data_id):
+    _persona_sessions.pop(chat_data_id)
+    if response_cache is not None:
+        response_cache.invalidate(chat_data_id)
+
+
+RESPONSE_CACHE_LOOKUPS = Counter('botme_response_cache_total', 'Response cache lookups, by result.', ['result'])
+RESPONSE_CACHE_SAVED = Counter('botme_response_cache_saved_seconds_total',
+                               'LLM seconds saved by response cache hits (estimated from the cached calls).')
+
+# Off unless RESPONSE_CACHE_ENABLED=1; per process like the persona sessions
+response_cache = ResponseCache(
+    maxsize=Config.RESPONSE_CACHE_SIZE,
+    ttl=Config.RESPONSE_CACHE_TTL,
+    max_bytes=Config.RESPONSE_CACHE_MAX_BYTES,
+    variants=Config.RESPONSE_CACHE_VARIANTS,
+    fuzzy_threshold=Config.RESPONSE_CACHE_FUZZY,
+    fuzzy_max_words=Config.RESPONSE_CACHE_FUZZY_MAX_WORDS,
+) if Config.RESPONSE_CACHE_ENABLED else None
+
+
+def _cached_reply(session, user_input):
+    """Look the input up in the response cache. Returns (reply or None, history fingerprint for storing)."""
+    if response_cache is None:
+        return None, None
+    with session.lock:
+        fp = ResponseCache.fingerprint(session.history, Config.RESPONSE_CACHE_HISTORY_TURNS)
+    reply, kind, saved_seconds = response_cache.get(session.chat_id, fp, user_input)
+    RESPONSE_CACHE_LOOKUPS.inc(result=kind)
+    record_request_value('response_cache', kind)
+    if reply is not None:
+        RESPONSE_CACHE_SAVED.inc(saved_seconds)
+    return reply, fp
+
+
+def _cache_reply(session, fp, user_input, response, llm_seconds):
+    if response_cache is not None:
+        response_cache.add(session.chat_id, fp, user_input, response, llm_seconds)
+
+
+@event.listens_for(ChatData, 'after_update')
+def _chat_data_updated(mapper, connection, target):
+    # Drop the cached session if the persona changed (new person => new examples)
+    if inspect(target).attrs.selected_person.history.has_changes():
+        invalidate_persona_session(target.id)
+
+
+@event.listens_for(ChatData, 'after_delete')
+def _chat_data_deleted(mapper, connection, target):
+    invalidate_persona_session(target.id)
+
+
+# Summaries are a second LLM call; they run here so a fold never holds up the turn that triggered it
+_summary_executor = ThreadPoolExecutor(max_workers=Config.SUMMARY_WORKERS, thread_name_prefix='summarize')
+
+
+def _fold_history(app, session, to_fold):
+    """Background half of a fold: summarize the messages, apply the summary to the session and persist it."""
+    try:
+        with span('chat_summarize'):
+            summary = summarize_history(session.selected_person, session.summary, to_fold)
+    except Exception:
+        logger.exception("Summarizing chat %s failed", session.chat_id)
+        session.cancel_fold()
+        return
+    covered_seq = to_fold[-1]["seq"]
+    session.apply_summary(summary, covered_seq)
+    with app.app_context():
+        try:
+            with span('chat_db_commit'):
+                try:
+                    save_summary(session.chat_id, summary, covered_seq)
+                    db.session.commit()
+                except IntegrityError:
+                    # Another worker inserted this chat's first summary meanwhile: retry as an update of its row
+                    db.session.rollback()
+                    save_summary(session.chat_id, summary, covered_seq)
+                    db.session.commit()
+        except Exception:
+            # The turns are stored, so a reload just reads them back unsummarized
+            logger.exception("Saving the summary of chat %s failed", session.chat_id)
+            db.session.rollback()
+        finally:
+            db.session.remove()
+
+
+def _save_turn(session, user_input, response):
+    """
+    Append the finished turn to the cached session and insert it as two ConversationTurn rows.
+    If the history went over its token budget, the oldest turns are folded into the running summary
+    in the background (the reply doesn't wait for it).
+    """
+    try:
+        with span('chat_db_commit'):
+            rows, to_fold = session.record_turn(user_input, response)
+            append_turns(session.chat_id, rows)
+            db.session.commit()
+    except IntegrityError:
+        # Another worker appended to this chat since we cached it: reload the window and retry once
+        db.session.rollback()
+        invalidate_persona_session(session.chat_id)
+        session = get_persona_session(session.chat_id)
+        with span('chat_db_commit'):
+            rows, to_fold = session.record_turn(user_input, response)
+            append_turns(session.chat_id, rows)
+            db.session.commit()
     
-    # Load persistent conversation history from DB (JSON string -> list of dicts)
+    if to_fold:
+        try:
+            _summary_executor.submit(_fold_history, current_app._get_current_object(), session, to_fold)
+        except RuntimeError:
+            # Executor shut down (interpreter exiting): leave the messages for the next fold
+            session.cancel_fold()
+
+
+BUSY_MESSAGE = "Server is busy right now, please try again in a moment."
+TIMEOUT_MESSAGE = "The reply took too long. Please try again."
+
+
+def _empty_response(selected_person):
+    return f"Sorry, {selected_person} couldn't think of a response right now."
+
+
+def _error_response(e, where):
+    # Log error (with stack trace) for debugging
+    logger.exception("Chatbot error in %s", where)
+    CHAT_TURNS.inc(outcome='error')
+    return f"Oops! Something went wrong while generating a response: {str(e)}. Please try again."
+
+
+def get_chatbot_response(chat_data_id, user_input, user_id=None):
+    """
+    Generate response using the cached persona session (loaded from the DB on first use).
+    Updates history in DB after response.
+    The LLM call goes through the model router (tier choice, hedging) and llm_executor:
+    LLMSaturated / LLMTimeout are raised to the caller
+    (so the route can answer 503/504) instead of being turned into a chat message.
+    With user_id, ChatNotFound is raised if the chat isn't that user's.
+    """
     try:
-        history = json.loads(chat_data.conversation_history)
-    except (json.JSONDecodeError, TypeError):
-        history = []
+        session = get_persona_session(chat_data_id, user_id)
+    except ChatNotFound:
+        CHAT_TURNS.inc(outcome='rejected')
+        raise
+    except ChatbotError as e:
+        CHAT_TURNS.inc(outcome='rejected')
+        return str(e)
     
     try:
-        prompt = create_chatbot_prompt(selected_person, person_msgs)
-        
-        # Create memory and inject existing history
-        memory = ConversationBufferMemory(return_messages=True)
-        # Add history messages to memory (role: "human" for user, "ai" for assistant)
-        for msg in history:
-            if msg.get("role") == "user":
-                memory.chat_memory.add_user_message(msg["content"])
-            elif msg.get("role") == "assistant":
-                memory.chat_memory.add_ai_message(msg["content"])
+        cached, fp = _cached_reply(session, user_input)
+        if cached is not None:
+            _save_turn(session, user_input, cached)
+            CHAT_TURNS.inc(outcome='cached')
+            return cached
         
-        # Create chain with prompt and memory
-        chain = ConversationChain(
-            llm=llm, 
-            prompt=prompt, 
-            memory=memory,
-            verbose=False  # Set to True for debugging
-        )
+        with span('chat_prompt_build'):
+            prompt_text = session.render_prompt(user_input)
         
-        # Generate response
-        result = chain.invoke({"input": user_input})
-        response = result['response']
+        # Generate response on the tier picked for this input
+        router = get_router()
+        tier, _ = router.choose(user_input)
+        record_request_value('llm_tier', tier)
+        with span('chat_llm'):
+            start = time.perf_counter()
+            result = router.invoke(prompt_text, tier)
+        response = getattr(result, "content", result)
         
         if not response or response.strip() == "":
-            response = f"Sorry, {selected_person} couldn't think of a response right now."
+            response = _empty_response(session.selected_person)
+        else:
+            _cache_reply(session, fp, user_input, response, time.perf_counter() - start)
         
-        # Append to persistent history in DB (user input + response)
-        history.append({"role": "user", "content": user_input})
-        history.append({"role": "assistant", "content": response})
-        # Keep only last 20 exchanges to prevent bloat (10 user + 10 assistant)
-        chat_data.conversation_history = json.dumps(history[-20:])
-        db.session.commit()
+        _save_turn(session, user_input, response)
+        CHAT_TURNS.inc(outcome='ok')
         
         return response
     
+    except (LLMSaturated, LLMTimeout):
+        CHAT_TURNS.inc(outcome='busy')
+        raise
+    except Exception as e:
+        return _error_response(e, "get_chatbot_response")
+
+
+def stream_chatbot_response(chat_data_id, user_input, user_id=None):
+    """
+    Same as get_chatbot_response, but yields the reply as text chunks while the LLM generates it.
+    History is only written to the DB once the whole reply has streamed successfully.
+    Errors are yielded as a final chunk (same messages as the non-streaming path);
+    check ownership with get_persona_session before starting the stream.
+    """
+    try:
+        session = get_persona_session(chat_data_id, user_id)
+    except ChatbotError as e:
+        CHAT_TURNS.inc(outcome='rejected')
+        yield str(e)
+        return
+    
+    parts = []
+    try:
+        cached, fp = _cached_reply(session, user_input)
+        if cached is not None:
+            yield cached
+            _save_turn(session, user_input, cached)
+            CHAT_TURNS.inc(outcome='cached')
+            return
+        
+        with span('chat_prompt_build'):
+            prompt_text = session.render_prompt(user_input)
+        
+        router = get_router()
+        tier, _ = router.choose(user_input)
+        record_request_value('llm_tier', tier)
+        with span('chat_llm'):
+            start = time.perf_counter()
+            for chunk in router.stream(prompt_text, tier):
+                text = getattr(chunk, "content", chunk)
+                if text:
+                    if not parts:
+                        STAGE_SECONDS.observe(time.perf_counter() - start, stage='chat_llm_first_token')
+                    parts.append(text)
+                    yield text
+        
+        response = "".join(parts).strip()
+        if not response:
+            response = _empty_response(session.selected_person)
+            yield response
+        else:
+            _cache_reply(session, fp, user_input, response, time.perf_counter() - start)
+        
+        # Only reached once the client has consumed the whole stream;
+        # if it disconnects mid-reply the generator is closed and nothing is saved
+        _save_turn(session, user_input, response)
+        CHAT_TURNS.inc(outcome='ok')
+    
+    except LLMSaturated:
+        CHAT_TURNS.inc(outcome='busy')
+        yield BUSY_MESSAGE
+    except LLMTimeout:
+        CHAT_TURNS.inc(outcome='busy')
+        yield TIMEOUT_MESSAGE
     except Exception as e:
-        # Log error for debugging
-        print(f"Chatbot error in get_chatbot_response: {e}")
-        import traceback
-        traceback.print_exc()  # Optional: Full stack trace in console
-        return f"Oops! Something went wrong while generating a response: {str(e)}. Please try again."
+        yield _error_response(e, "stream_chatbot_response")
@@ -0,0 +1,79 @@
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+
+def normalize_database_uri(uri):
+    """Accept the "postgres://" scheme some hosts hand out; SQLAlchemy only knows "postgresql://"."""
+    if uri.startswith('postgres://'):
+        return 'postgresql://' + uri[len('postgres://'):]
+    return uri
+
+
+def is_sqlite(uri):
+    return make_url(uri).get_backend_name() == 'sqlite'
+
+
+def engine_options(config):
+    """
+    SQLALCHEMY_ENGINE_OPTIONS for the configured database.
+    SQLite files get a small pool of thread-shareable connections (WAL lets readers run next to the writer);
+    server databases get a sized pool with pre-ping and recycling so idle connections dropped by the server
+    don't surface as request errors.
+    """
+    uri = config['SQLALCHEMY_DATABASE_URI']
+    if is_sqlite(uri):
+        if make_url(uri).database in (None, '', ':memory:'):
+            return {}  # in-memory: keep SQLAlchemy's single shared connection
+        return {
+            'pool_size': config['DB_POOL_SIZE'],
+            'max_overflow': config['DB_MAX_OVERFLOW'],
+            'pool_timeout': config['DB_POOL_TIMEOUT'],
+            'connect_args': {'check_same_thread': False},
+        }
+    return {
+        'pool_size': config['DB_POOL_SIZE'],
+        'max_overflow': config['DB_MAX_OVERFLOW'],
+        'pool_timeout': config['DB_POOL_TIMEOUT'],
+        'pool_recycle': config['DB_POOL_RECYCLE'],
+        'pool_pre_ping': True,
+    }
+
+
+def install_sqlite_pragmas(engine, journal_mode='wal', synchronous='normal', busy_timeout=5000, foreign_keys=True):
+    """
+    Apply per-connection PRAGMAs to every new SQLite connection of `engine` (no-op for other backends).
+    journal_mode=wal: readers don't block the writer and vice versa
+    synchronous=normal: with WAL, fsync at checkpoints only (safe against app crashes, not power loss)
+    busy_timeout (ms): wait for the write lock instead of failing with "database is locked"
+    foreign_keys: enforce ON DELETE CASCADE / SET NULL like a server database would
+    """
+    if engine.dialect.name != 'sqlite':
+        return
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, _record):
+        cursor = dbapi_connection.cursor()
+        try:
+            if journal_mode:
+                cursor.execute(f'PRAGMA journal_mode={journal_mode}')
+            if synchronous:
+                cursor.execute(f'PRAGMA synchronous={synchronous}')
+            cursor.execute(f'PRAGMA busy_timeout={int(busy_timeout)}')
+            cursor.execute(f'PRAGMA foreign_keys={"ON" if foreign_keys else "OFF"}')
+        finally:
+            cursor.close()
+
+
+def init_database(app, db):
+    """Configure the engine for app.config and bind Flask-SQLAlchemy to the app."""
+    app.config['SQLALCHEMY_DATABASE_URI'] = normalize_database_uri(app.config['SQLALCHEMY_DATABASE_URI'])
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', engine_options(app.config))
+    db.init_app(app)
+    with app.app_context():
+        install_sqlite_pragmas(
+            db.engine,
+            journal_mode=app.config['SQLITE_JOURNAL_MODE'],
+            synchronous=app.config['SQLITE_SYNCHRONOUS'],
+            busy_timeout=app.config['SQLITE_BUSY_TIMEOUT'],
+            foreign_keys=app.config['SQLITE_FOREIGN_KEYS'],
+        )
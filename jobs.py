@@ -0,0 +1,194 @@
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from models import db, ChatData, UploadJob, encode_messages, save_participant_blobs
+from parse_chat import parse_chat_file
+from metrics import STAGE_SECONDS, PARSED_MESSAGES, record_stage
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+# Finished parses wait here for the writer thread. Done-callbacks of a process pool run on its manager
+# thread, so doing the DB writes there would stop the pool handing out work while SQLite is busy.
+_finished = queue.Queue()
+_writer = None
+
+
+def get_executor(app):
+    """Create the upload worker pool on first use (processes by default, so parsing runs on other cores)."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            workers = app.config.get('UPLOAD_WORKERS') or os.cpu_count() or 2
+            if app.config.get('UPLOAD_EXECUTOR', 'process') == 'thread':
+                _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='upload')
+            else:
+                _executor = ProcessPoolExecutor(max_workers=workers)
+        return _executor
+
+
+def reset_executor():
+    """Drop a broken pool (e.g. a worker was killed for memory); the next get_executor starts a fresh one."""
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+def _write_finished():
+    while True:
+        args = _finished.get()
+        try:
+            _finish_upload(*args)
+        except Exception:
+            logger.exception("Upload writer failed")
+
+
+def _start_writer():
+    global _writer
+    with _executor_lock:
+        if _writer is None:
+            _writer = threading.Thread(target=_write_finished, name='upload-writer', daemon=True)
+            _writer.start()
+
+
+def encode_participants(messages_by_person):
+    """Compress each participant's messages: [(name, message count, raw bytes, zlib data)]."""
+    blobs = []
+    for name, msgs in messages_by_person.items():
+        data, raw_bytes = encode_messages(msgs)
+        blobs.append((name, len(msgs), raw_bytes, data))
+    return blobs
+
+
+def remove_file(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def fail_job(job_id, error):
+    """
+    Roll back whatever the session holds and mark the job failed, so the dashboard stops polling.
+    Never raises: if even that fails it's logged, and the sweeper removes the job later.
+    """
+    try:
+        db.session.rollback()
+        job = db.session.get(UploadJob, job_id)
+        if job is not None:
+            job.status = 'failed'
+            job.error = error
+            db.session.commit()
+    except Exception:
+        logger.exception("Could not mark job %s failed", job_id)
+
+
+def save_upload(app, user_id, file_storage, suffix):
+    """Save an uploaded file under UPLOAD_TMP_DIR and record a queued UploadJob for it. Returns (job id, path)."""
+    job_id = uuid.uuid4().hex
+    upload_dir = app.config.get('UPLOAD_TMP_DIR')
+    os.makedirs(upload_dir, exist_ok=True)
+    path = os.path.join(upload_dir, f'{job_id}{suffix}')
+    file_storage.save(path)
+
+    db.session.add(UploadJob(id=job_id, user_id=user_id, status='queued'))
+    db.session.commit()
+    return job_id, path
+
+
+def parse_upload_file(path):
+    """
+    Worker-side half of an upload job: parse the saved export and compress each participant's messages.
+    Runs in a pool process, so it only reads the file, never the DB, and leaves metrics to the parent
+    (anything recorded here would die with the worker).
+    Returns {'blobs': [(name, message count, raw bytes, zlib data)] for every participant,
+             'message_count': int, 'parse_seconds': float}.
+    """
+    with open(path, encoding='utf-8-sig') as f:
+        parsed = parse_chat_file(f, record_metrics=False)
+    return {
+        'blobs': encode_participants(parsed['messages_by_person']),
+        'message_count': parsed['message_count'],
+        'parse_seconds': parsed['parse_seconds'],
+    }
+
+
+def _finish_upload(app, job_id, user_id, path, started, future):
+    """
+    Writer-thread half of an upload job: store the parsed chat as a temp ChatData row and mark the job
+    ready (or failed). Whatever goes wrong, the job leaves 'queued' and the saved export is removed.
+    """
+    STAGE_SECONDS.observe(time.perf_counter() - started, stage='upload_job')
+    with app.app_context():
+        try:
+            job = db.session.get(UploadJob, job_id)
+            if job is None:
+                return
+            try:
+                result = future.result()
+                record_stage('parse_chat', result['parse_seconds'])
+                PARSED_MESSAGES.inc(result['message_count'])
+                blobs = result['blobs']
+                if len(blobs) < 2:
+                    raise ValueError("Chat must have at least 2 participants.")
+            except (ValueError, IndexError) as e:
+                # Parsing errors get the same user-friendly message the old synchronous route used
+                job.status = 'failed'
+                job.error = f"Error parsing chat file: {e}. Please ensure it's a valid WhatsApp chat export."
+            else:
+                temp_chat = ChatData(
+                    user_id=user_id,
+                    selected_person=None,
+                    all_messages='',
+                    messages='[]',
+                    conversation_history='[]',
+                    is_temp=True
+                )
+                db.session.add(temp_chat)
+                db.session.flush()
+                save_participant_blobs(temp_chat.id, blobs)
+                job.chat_id = temp_chat.id
+                job.status = 'ready'
+            db.session.commit()
+        except Exception as e:
+            # Covers a dead worker, a failed insert and a failed commit alike
+            logger.exception("Upload job %s failed", job_id)
+            fail_job(job_id, f"An unexpected error occurred: {e}")
+        finally:
+            remove_file(path)
+            db.session.remove()
+
+
+def submit_upload(app, user_id, file_storage):
+    """
+    Save the uploaded file to disk, record a queued UploadJob and hand parsing to the worker pool.
+    Returns the job id right away; the request never waits for the parse. If the pool won't take the
+    job, it's marked failed straight away and the poll reports why.
+    """
+    job_id, path = save_upload(app, user_id, file_storage, '.txt')
+    try:
+        try:
+            future = get_executor(app).submit(parse_upload_file, path)
+        except BrokenProcessPool:
+            # A worker died (e.g. killed for memory); start a fresh pool and try once more
+            reset_executor()
+            future = get_executor(app).submit(parse_upload_file, path)
+    except Exception as e:
+        logger.exception("Could not queue upload job %s", job_id)
+        remove_file(path)
+        fail_job(job_id, f"Could not start processing the upload: {e}")
+        return job_id
+    started = time.perf_counter()
+    _start_writer()
+    future.add_done_callback(lambda f: _finished.put((app, job_id, user_id, path, started, f)))
+    return job_id
@@ -0,0 +1,145 @@
+import hashlib
+import math
+import random
+import threading
+import time
+
+from config import Config
+from metrics import STAGE_SECONDS
+
+# Canned Roman Urdu replies for the stub backend
+STUB_REPLIES = [
+    "haan yaar theek hun, tum sunao?",
+    "acha acha 😂 phir kya hua",
+    "kal baat karte hain, abhi thora busy hun",
+    "sahi keh rahe ho bhai",
+    "nahi yaar mujhe nahi pata 😅",
+    "chalo theek hai, done",
+    "kya scene hai aaj ka?",
+    "hahaha pagal ho tum",
+]
+
+
+def latency_sampler(spec, rng=None):
+    """
+    Turn a latency setting into a function returning seconds per call:
+    0.5 or "0.5": always 0.5s
+    "lognormal:0.4:0.5": lognormal with median 0.4s and sigma 0.5 (a provider's usual long right tail)
+    "stall:0.3:0.05:8": 0.3s, except 5% of calls stall for 8s (what hedged requests are for)
+    """
+    rng = rng or random.Random()
+    if callable(spec):
+        return spec
+    if isinstance(spec, (int, float)) or ':' not in spec:
+        value = float(spec)
+        return lambda: value
+    kind, *params = spec.split(':')
+    params = [float(p) for p in params]
+    if kind == 'lognormal':
+        median, sigma = params
+        return lambda: rng.lognormvariate(math.log(median), sigma) if median else 0.0
+    if kind == 'stall':
+        base, share, stall = params
+        return lambda: stall if rng.random() < share else base
+    raise ValueError(f"Unknown latency distribution '{spec}' (use a number, lognormal:MEDIAN:SIGMA "
+                     f"or stall:BASE:SHARE:SECONDS)")
+
+
+class StubLLM:
+    """
+    Deterministic local stand-in for the chat model, for benchmarks and offline development.
+    The same prompt always gets the same reply. Timing mimics a real provider:
+    latency: seconds before the first token, a number or any latency_sampler() spec / callable
+    tokens_per_sec: generation speed after that (0 = instant)
+    Exposes the same invoke()/stream() calls chatbot.py uses on the langchain model.
+    """
+
+    def __init__(self, latency=0.0, tokens_per_sec=0.0, replies=None):
+        self.latency = latency_sampler(latency)
+        self.tokens_per_sec = tokens_per_sec
+        self.replies = replies or STUB_REPLIES
+        self.calls = 0
+
+    def _reply_for(self, prompt):
+        seed = int(hashlib.sha1(str(prompt).encode('utf-8')).hexdigest()[:8], 16)
+        rng = random.Random(seed)
+        return " ".join(rng.sample(self.replies, 2))
+
+    def stream(self, prompt, **kwargs):
+        self.calls += 1
+        latency = self.latency()
+        if latency:
+            time.sleep(latency)
+        words = self._reply_for(prompt).split(" ")
+        delay = 1.0 / self.tokens_per_sec if self.tokens_per_sec else 0
+        for i, word in enumerate(words):
+            if delay:
+                time.sleep(delay)
+            yield word if i == 0 else " " + word
+
+    def invoke(self, prompt, **kwargs):
+        return "".join(self.stream(prompt))
+
+
+# Model tiers: "main" answers most turns, "fast" is the cheaper model short/trivial turns are routed to
+# (see routing.py). Each backend builds the client for a tier.
+TIERS = ('main', 'fast')
+
+
+def _openai_backend(tier='main'):
+    # Imported here so stub runs don't need the OpenAI client at all
+    from langchain_openai import ChatOpenAI
+    model = Config.OPENAI_MODEL if tier == 'main' else Config.LLM_FAST_MODEL
+    return ChatOpenAI(model=model, temperature=0.7, openai_api_key=Config.OPENAI_API_KEY)
+
+
+def _stub_backend(tier='main'):
+    latency = Config.STUB_LLM_LATENCY if tier == 'main' else Config.STUB_FAST_LLM_LATENCY
+    return StubLLM(latency=latency, tokens_per_sec=Config.STUB_LLM_TOKENS_PER_SEC)
+
+
+# name -> factory; pick one with the LLM_BACKEND (and LLM_FAST_BACKEND) setting
+BACKENDS = {
+    'openai': _openai_backend,
+    'stub': _stub_backend,
+}
+
+
+def backend_for(tier='main'):
+    """Configured backend name for a tier ('' = the tier is off)."""
+    return Config.LLM_BACKEND if tier == 'main' else Config.LLM_FAST_BACKEND
+
+
+def create_llm(name=None, tier='main'):
+    """Build the LLM client for a tier (its configured backend unless name is given)."""
+    name = name or backend_for(tier)
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown LLM backend '{name}'. Choose one of: {', '.join(sorted(BACKENDS))}")
+    return BACKENDS[name](tier)
+
+
+# tier -> client, built by get_llm() on first use and shared by every request in this process
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_llm(tier='main'):
+    """
+    Shared LLM client for a tier, created on the first chat request rather than at import,
+    so workers and CLI/test processes that never chat skip langchain/OpenAI entirely.
+    """
+    client = _clients.get(tier)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(tier)
+            if client is None:
+                start = time.perf_counter()
+                client = _clients[tier] = create_llm(tier=tier)
+                STAGE_SECONDS.observe(time.perf_counter() - start, stage='llm_init')
+    return client
+
+
+def reset_llms():
+    """Forget the shared clients (the next get_llm() builds new ones, e.g. after a config change)."""
+    with _clients_lock:
+        _clients.clear()
@@ -0,0 +1,221 @@
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from config import Config
+from metrics import Counter, STAGE_SECONDS
+
+LLM_REJECTED = Counter('botme_llm_rejected_total', 'LLM calls refused or abandoned, by reason.', ['reason'])
+LLM_HEDGES = Counter('botme_llm_hedges_total', 'Hedged LLM calls: fired, won (hedge answered first) '
+                     'or skipped (no idle slot).', ['outcome'])
+
+
+class LLMSaturated(Exception):
+    """All LLM slots and queue places are taken; the caller should answer 503 right away."""
+
+
+class LLMTimeout(Exception):
+    """An LLM call didn't finish within its deadline."""
+
+
+class _Failure:
+    def __init__(self, exc):
+        self.exc = exc
+
+
+_DONE = object()
+
+
+class LLMExecutor:
+    """
+    Runs LLM calls on a dedicated thread pool so their concurrency is capped independently of
+    how many web threads there are.
+    max_concurrency: calls running at once (what the provider / API key can take)
+    max_queue: extra calls allowed to wait for a slot; beyond that submit raises LLMSaturated
+    timeout: default seconds a caller waits before giving up with LLMTimeout
+    """
+
+    def __init__(self, max_concurrency=8, max_queue=16, timeout=60):
+        self.max_concurrency = max_concurrency
+        self.capacity = max_concurrency + max_queue
+        self.timeout = timeout
+        self._pool = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix='llm')
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    @property
+    def pending(self):
+        """Calls running or waiting right now."""
+        return self._pending
+
+    def saturated(self):
+        return self._pending >= self.capacity
+
+    def _acquire(self):
+        with self._lock:
+            if self._pending >= self.capacity:
+                LLM_REJECTED.inc(reason='saturated')
+                raise LLMSaturated(f"{self._pending} LLM calls in flight (limit {self.capacity})")
+            self._pending += 1
+
+    def _release(self, _future=None):
+        with self._lock:
+            self._pending -= 1
+
+    def _submit(self, fn, *args):
+        self._acquire()
+        queued_at = time.perf_counter()
+
+        def task():
+            STAGE_SECONDS.observe(time.perf_counter() - queued_at, stage='llm_queue_wait')
+            return fn(*args)
+
+        try:
+            future = self._pool.submit(task)
+        except Exception:
+            self._release()
+            raise
+        future.add_done_callback(self._release)
+        return future
+
+    def _hedge(self, fn, *args):
+        """Start a duplicate call, but only on an idle slot: a hedge never queues behind real traffic."""
+        with self._lock:
+            idle = self._pending < self.max_concurrency
+        if not idle:
+            LLM_HEDGES.inc(outcome='skipped')
+            return None
+        try:
+            future = self._submit(fn, *args)
+        except LLMSaturated:
+            return None
+        LLM_HEDGES.inc(outcome='fired')
+        return future
+
+    def run(self, fn, *args, timeout=None, hedge_after=None):
+        """
+        Call fn(*args) on the pool and wait for the result.
+        Raises LLMSaturated immediately when full, LLMTimeout after the deadline
+        (a queued call is cancelled; one already talking to the provider finishes in the background).
+        With hedge_after (seconds), a second identical call is started if the first hasn't answered by then;
+        whichever succeeds first wins, and the call only fails once both have.
+        """
+        timeout = timeout or self.timeout
+        deadline = time.monotonic() + timeout
+        futures = [self._submit(fn, *args)]
+        try:
+            if hedge_after is not None and hedge_after < timeout:
+                done, _ = wait(futures, timeout=hedge_after)
+                if not done:
+                    hedge = self._hedge(fn, *args)
+                    if hedge is not None:
+                        futures.append(hedge)
+            pending = list(futures)
+            error = None
+            while pending:
+                done, _ = wait(pending, timeout=max(0, deadline - time.monotonic()), return_when=FIRST_COMPLETED)
+                if not done:
+                    LLM_REJECTED.inc(reason='timeout')
+                    raise LLMTimeout(f"LLM call took longer than {timeout}s")
+                for future in done:
+                    pending.remove(future)
+                    if future.exception() is None:
+                        if future is not futures[0]:
+                            LLM_HEDGES.inc(outcome='won')
+                        return future.result()
+                    error = future.exception()
+            raise error
+        finally:
+            for future in futures:
+                future.cancel()
+
+    def stream(self, fn, *args, timeout=None, hedge_after=None):
+        """
+        Run the generator fn(*args) on the pool and return an iterator over its chunks.
+        The slot is taken right here, so LLMSaturated is raised before any output.
+        Closing the iterator (e.g. the client disconnected) stops the producer at its next chunk.
+        With hedge_after, a second identical stream is started if no chunk arrived by then; the first one
+        to produce a chunk is used and the other is stopped.
+        """
+        chunks = queue.Queue()
+        attempts = []  # [(future, cancelled event)]
+
+        def start():
+            cancelled = threading.Event()
+            attempt = len(attempts)
+
+            def produce():
+                try:
+                    for chunk in fn(*args):
+                        if cancelled.is_set():
+                            LLM_REJECTED.inc(reason='cancelled')
+                            break
+                        chunks.put((attempt, chunk))
+                except BaseException as e:
+                    chunks.put((attempt, _Failure(e)))
+                finally:
+                    chunks.put((attempt, _DONE))
+
+            submit = self._submit if not attempts else self._hedge
+            future = submit(produce)
+            if future is not None:
+                attempts.append((future, cancelled))
+            return future
+
+        start()
+        timeout = timeout or self.timeout
+        deadline = time.monotonic() + timeout
+        hedge_at = time.monotonic() + hedge_after if hedge_after is not None else None
+
+        def consume():
+            winner = None
+            hedged = hedge_at is None
+            finished = set()
+            try:
+                while True:
+                    now = time.monotonic()
+                    wait_until = deadline
+                    if winner is None and not hedged:
+                        wait_until = min(deadline, hedge_at)
+                    try:
+                        if wait_until <= now:
+                            raise queue.Empty
+                        attempt, item = chunks.get(timeout=wait_until - now)
+                    except queue.Empty:
+                        if wait_until < deadline:
+                            hedged = True  # one try: skipped for good if there's no idle slot
+                            start()
+                            continue
+                        LLM_REJECTED.inc(reason='timeout')
+                        raise LLMTimeout(f"LLM stream took longer than {timeout}s")
+                    if winner is not None and attempt != winner:
+                        continue
+                    if item is _DONE or isinstance(item, _Failure):
+                        finished.add(attempt)
+                        if winner is None and len(finished) < len(attempts):
+                            continue  # the other attempt may still answer
+                        if item is _DONE:
+                            return
+                        raise item.exc
+                    if winner is None:
+                        winner = attempt
+                        if winner:
+                            LLM_HEDGES.inc(outcome='won')
+                        for i, (_, cancelled) in enumerate(attempts):
+                            if i != winner:
+                                cancelled.set()
+                    yield item
+            finally:
+                for future, cancelled in attempts:
+                    cancelled.set()
+                    future.cancel()
+
+        return consume()
+
+
+llm_executor = LLMExecutor(
+    max_concurrency=Config.LLM_MAX_CONCURRENCY,
+    max_queue=Config.LLM_MAX_QUEUE,
+    timeout=Config.LLM_TIMEOUT,
+)
@@ -0,0 +1,148 @@
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+
+from models import (db, ChatData, UploadJob, BulkImportFile, BulkPersona, drop_participant_blobs,
+                    migrate_legacy_chat_data)
+from metrics import Counter, STAGE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+TEMP_ROWS_PURGED = Counter('botme_temp_rows_purged_total', 'Expired temporary rows deleted by the sweeper.', ['table'])
+
+
+def ensure_indexes():
+    """create_all() only adds indexes with new tables; add ones introduced later to existing databases."""
+    for table in (ChatData.__table__, UploadJob.__table__):
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
+
+
+def prepare_database():
+    """
+    Create missing tables and indexes and move legacy JSON columns into the new tables.
+    Idempotent; returns the number of chats migrated.
+    """
+    start = time.perf_counter()
+    db.create_all()
+    ensure_indexes()
+    migrated = migrate_legacy_chat_data()
+    STAGE_SECONDS.observe(time.perf_counter() - start, stage='db_setup')
+    return migrated
+
+
+def _delete_in_batches(model, where, batch_size, before_delete=None):
+    """Delete matching rows batch_size at a time, committing after each batch. Returns rows deleted."""
+    deleted = 0
+    while True:
+        ids = db.session.execute(db.select(model.id).where(*where).limit(batch_size)).scalars().all()
+        if not ids:
+            return deleted
+        if before_delete:
+            before_delete(ids)
+        db.session.execute(db.delete(model).where(model.id.in_(ids)))
+        db.session.commit()
+        deleted += len(ids)
+
+
+def purge_expired_temp_chats(max_age=3600, batch_size=500):
+    """
+    Delete temp ChatData rows (uploads nobody picked a person for) and UploadJob rows older than max_age
+    seconds. Each batch is one indexed SELECT of ids plus one DELETE ... WHERE id IN (...), so locks are short
+    and the amount of garbage never has to fit in memory. Returns (chats deleted, jobs deleted).
+    """
+    cutoff = datetime.utcnow() - timedelta(seconds=max_age)
+
+    # Done by hand: SQLite only honours ON DELETE SET NULL / CASCADE with foreign keys switched on
+    def detach_rows(chat_ids):
+        db.session.execute(db.update(UploadJob).where(UploadJob.chat_id.in_(chat_ids)).values(chat_id=None))
+        db.session.execute(db.update(BulkImportFile).where(BulkImportFile.chat_id.in_(chat_ids)).values(chat_id=None))
+        drop_participant_blobs(chat_ids)
+
+    def drop_job_files(job_ids):
+        db.session.execute(db.delete(BulkImportFile).where(BulkImportFile.job_id.in_(job_ids)))
+        db.session.execute(db.delete(BulkPersona).where(BulkPersona.job_id.in_(job_ids)))
+
+    jobs = _delete_in_batches(UploadJob, [UploadJob.created_at < cutoff], batch_size, before_delete=drop_job_files)
+    chats = _delete_in_batches(ChatData, [ChatData.is_temp.is_(True), ChatData.created_at < cutoff],
+                               batch_size, before_delete=detach_rows)
+    TEMP_ROWS_PURGED.inc(chats, table='chat_data')
+    TEMP_ROWS_PURGED.inc(jobs, table='upload_job')
+    return chats, jobs
+
+
+def database_size():
+    """
+    Return {'bytes', 'free_bytes'} for a SQLite database (free = pages VACUUM would give back),
+    or None for other backends.
+    """
+    if db.engine.dialect.name != 'sqlite':
+        return None
+    page_size = db.session.execute(db.text('PRAGMA page_size')).scalar()
+    page_count = db.session.execute(db.text('PRAGMA page_count')).scalar()
+    free_pages = db.session.execute(db.text('PRAGMA freelist_count')).scalar()
+    return {'bytes': page_size * page_count, 'free_bytes': page_size * free_pages}
+
+
+def vacuum_database():
+    """Rebuild the SQLite file so space freed by deleted blobs goes back to the OS. No-op on other backends."""
+    if db.engine.dialect.name != 'sqlite':
+        return
+    db.session.commit()
+    # VACUUM can't run inside a transaction
+    with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+        conn.execute(db.text('VACUUM'))
+
+
+class TempChatSweeper:
+    """
+    Background thread that purges expired temp rows every `interval` seconds.
+    With vacuum_ratio set, the database is also VACUUMed once that share of the file is free pages.
+    """
+
+    def __init__(self, app, interval=300, max_age=3600, batch_size=500, vacuum_ratio=None):
+        self.app = app
+        self.interval = interval
+        self.max_age = max_age
+        self.batch_size = batch_size
+        self.vacuum_ratio = vacuum_ratio
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='temp-chat-sweeper', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        # First sweep right away (in the background, so startup doesn't wait for it)
+        while True:
+            try:
+                self.sweep()
+            except Exception:
+                logger.exception("Temp chat sweep failed")
+            if self._stop.wait(self.interval):
+                return
+
+    def sweep(self):
+        start = time.perf_counter()
+        with self.app.app_context():
+            try:
+                chats, jobs = purge_expired_temp_chats(self.max_age, self.batch_size)
+                size = database_size()
+                if size and self.vacuum_ratio and size['free_bytes'] > size['bytes'] * self.vacuum_ratio:
+                    vacuum_database()
+                    size = database_size()
+            finally:
+                db.session.remove()
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage='temp_sweep')
+        if chats or jobs:
+            logger.info("Purged %d temp chats and %d upload jobs%s", chats, jobs,
+                        f"; database {size['bytes'] / 1e6:.1f} MB ({size['free_bytes'] / 1e6:.1f} MB free)"
+                        if size else "")
+        return chats, jobs
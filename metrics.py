@@ -0,0 +1,145 @@
+import bisect
+import logging
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import g, has_request_context
+
+# Default latency buckets (seconds): sub-ms DB work up to slow LLM calls
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_registry = []
+
+
+def percentile(sorted_values, pct, default=None):
+    """Nearest-rank percentile of an already sorted sequence; default when it's empty."""
+    if not sorted_values:
+        return default
+    return sorted_values[max(0, math.ceil(len(sorted_values) * pct / 100) - 1)]
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+
+class Counter:
+    """Monotonic counter, optionally split by labels (Prometheus 'counter')."""
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(n, '')) for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        key = tuple(str(labels.get(n, '')) for n in self.labelnames)
+        with self._lock:
+            return self._values.get(key, 0)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_format_labels(self.labelnames, key)} {value}')
+        return lines
+
+
+class Histogram:
+    """Bucketed distribution, optionally split by labels (Prometheus 'histogram')."""
+
+    def __init__(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(n, '')) for n in self.labelnames)
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            series[idx] += 1  # idx == len(buckets) is the +Inf-only bucket
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, series):
+                    cumulative += count
+                    lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, key, ("le", bound))} {cumulative}')
+                lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, key, ("le", "+Inf"))} {series[-1]}')
+                lines.append(f'{self.name}_sum{_format_labels(self.labelnames, key)} {series[-2]}')
+                lines.append(f'{self.name}_count{_format_labels(self.labelnames, key)} {series[-1]}')
+        return lines
+
+
+def render_metrics():
+    """All registered metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+# Hot-path metrics shared by app.py, chatbot.py and parse_chat.py
+STAGE_SECONDS = Histogram('botme_stage_seconds', 'Time spent in each stage of a request.', ['stage'])
+REQUEST_SECONDS = Histogram('botme_request_seconds', 'HTTP request latency.', ['endpoint', 'method', 'status'])
+PROMPT_TOKENS = Histogram('botme_prompt_tokens', 'Tokens in each rendered chat prompt.',
+                          buckets=(250, 500, 1000, 1500, 2000, 3000, 4000, 6000, 8000, 16000))
+PAYLOAD_BYTES = Histogram('botme_payload_bytes', 'Request/response body sizes.', ['endpoint', 'direction'],
+                          buckets=(256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216))
+CHAT_TURNS = Counter('botme_chat_turns_total', 'Chat turns answered, by outcome.', ['outcome'])
+PARSED_MESSAGES = Counter('botme_parsed_messages_total', 'Messages extracted from uploaded exports.')
+
+
+@contextmanager
+def span(stage):
+    """
+    Time a block of code into botme_stage_seconds{stage=...}.
+    Inside a request the duration is also kept on flask.g for the structured request log.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - start)
+
+
+def record_stage(stage, seconds):
+    """Record a stage duration measured elsewhere (e.g. returned by a pool worker) like span() would."""
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    if has_request_context():
+        stages = g.setdefault('metrics_stages', {})
+        stages[stage] = stages.get(stage, 0.0) + seconds
+
+
+def record_request_value(key, value):
+    """Attach an extra field (e.g. prompt_tokens) to the current request's structured log line."""
+    if has_request_context():
+        g.setdefault('metrics_extra', {})[key] = value
+
+
+request_logger = logging.getLogger('botme.requests')
@@ -2,6 +2,8 @@ from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime
+import json
+import zlib
 
 db = SQLAlchemy()
 
@@ -22,15 +24,331 @@ class User(UserMixin, db.Model):
     def __repr__(self):
         return f'<User {self.username} (ID: {self.id})>'
 
+
+class UserIdentity(UserMixin):
+    """Plain (non-ORM) copy of a user's id/username/email, so flask-login can keep it cached between requests."""
+
+    def __init__(self, id, username, email):
+        self.id = id
+        self.username = username
+        self.email = email
+
+    def __repr__(self):
+        return f'<UserIdentity {self.username} (ID: {self.id})>'
+
+
+def load_user_identity(user_id):
+    """One primary-key SELECT of the columns the views use; None if the user doesn't exist."""
+    row = db.session.execute(
+        db.select(User.id, User.username, User.email).where(User.id == user_id)
+    ).first()
+    return UserIdentity(*row) if row else None
+
+
+def user_exists(username, email):
+    """True if the username or the email is taken (single query over both unique indexes)."""
+    return db.session.execute(
+        db.select(User.id).where(db.or_(User.username == username, User.email == email)).limit(1)
+    ).first() is not None
+
 class ChatData(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     selected_person = db.Column(db.String(100), nullable=True)  # Can be None for temp
-    all_messages = db.Column(db.Text, default='[]', nullable=False)  # JSON of full messages_by_person for temp stage
-    messages = db.Column(db.Text, default='[]', nullable=False)  # JSON of final selected messages (list of dicts or strings)
-    conversation_history = db.Column(db.Text, default='[]', nullable=False)  # NEW: JSON list of {"role": "user/assistant", "content": str}
+    all_messages = db.Column(db.Text, default='', nullable=False)  # LEGACY: JSON messages_by_person, now in ParticipantBlob
+    messages = db.Column(db.Text, default='[]', nullable=False)  # LEGACY: JSON list of examples, now in ExampleMessage
+    conversation_history = db.Column(db.Text, default='[]', nullable=False)  # LEGACY: JSON history, now in ConversationTurn
     is_temp = db.Column(db.Boolean, default=False, nullable=False)  # Flag for temporary entries
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    example_messages = db.relationship('ExampleMessage', backref='chat', lazy='dynamic',
+                                       cascade='all, delete-orphan', passive_deletes=True)
+    conversation_turns = db.relationship('ConversationTurn', backref='chat', lazy='dynamic',
+                                         cascade='all, delete-orphan', passive_deletes=True)
+    conversation_summary = db.relationship('ConversationSummary', uselist=False,
+                                           cascade='all, delete-orphan', passive_deletes=True)
+    persona_profile = db.relationship('PersonaProfile', uselist=False,
+                                      cascade='all, delete-orphan', passive_deletes=True)
+    participant_blobs = db.relationship('ParticipantBlob', backref='chat', lazy='dynamic',
+                                        cascade='all, delete-orphan', passive_deletes=True)
+
+    # The temp-row sweeper finds expired uploads through this index instead of scanning every chat
+    __table_args__ = (db.Index('ix_chat_data_temp_created', 'is_temp', 'created_at'),)
  
     def __repr__(self):
         return f'<ChatData {self.id} for User {self.user_id}, Temp: {self.is_temp}>'
+
+class ExampleMessage(db.Model):
+    """One style example (a message written by the selected person), kept in chat order by seq."""
+    id = db.Column(db.Integer, primary_key=True)
+    chat_id = db.Column(db.Integer, db.ForeignKey('chat_data.id', ondelete='CASCADE'), nullable=False)
+    seq = db.Column(db.Integer, nullable=False)
+    content = db.Column(db.Text, nullable=False)
+
+    __table_args__ = (db.Index('ix_example_message_chat_seq', 'chat_id', 'seq', unique=True),)
+
+    def __repr__(self):
+        return f'<ExampleMessage {self.chat_id}#{self.seq}>'
+
+class ConversationTurn(db.Model):
+    """One message of the bot conversation (role: "user" or "assistant"); rows are only ever appended."""
+    id = db.Column(db.Integer, primary_key=True)
+    chat_id = db.Column(db.Integer, db.ForeignKey('chat_data.id', ondelete='CASCADE'), nullable=False)
+    seq = db.Column(db.Integer, nullable=False)
+    role = db.Column(db.String(16), nullable=False)
+    content = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (db.Index('ix_conversation_turn_chat_seq', 'chat_id', 'seq', unique=True),)
+
+    def __repr__(self):
+        return f'<ConversationTurn {self.chat_id}#{self.seq} {self.role}>'
+
+
+class ConversationSummary(db.Model):
+    """Running summary of the turns that no longer fit the prompt's history budget (one row per chat)."""
+    chat_id = db.Column(db.Integer, db.ForeignKey('chat_data.id', ondelete='CASCADE'), primary_key=True)
+    content = db.Column(db.Text, nullable=False, default='')
+    covered_seq = db.Column(db.Integer, nullable=False, default=-1)  # last ConversationTurn.seq folded in
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<ConversationSummary {self.chat_id} up to #{self.covered_seq}>'
+
+
+class PersonaProfile(db.Model):
+    """Style fingerprint + curated examples of the selected person, computed once at selection time."""
+    chat_id = db.Column(db.Integer, db.ForeignKey('chat_data.id', ondelete='CASCADE'), primary_key=True)
+    data = db.Column(db.Text, nullable=False)  # JSON from style_profile.build_style_profile
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<PersonaProfile {self.chat_id}>'
+
+
+class ParticipantBlob(db.Model):
+    """
+    One participant's messages from an uploaded export, kept until a person is selected.
+    The messages are zlib-compressed JSON; the counts sit in their own columns so the
+    selection page never has to read or inflate the blob.
+    """
+    chat_id = db.Column(db.Integer, db.ForeignKey('chat_data.id', ondelete='CASCADE'), primary_key=True)
+    name = db.Column(db.String(100), primary_key=True)
+    message_count = db.Column(db.Integer, nullable=False)
+    raw_bytes = db.Column(db.Integer, nullable=False)  # size of the uncompressed JSON
+    data = db.Column(db.LargeBinary, nullable=False)
+
+    def __repr__(self):
+        return f'<ParticipantBlob {self.chat_id} {self.name!r} ({self.message_count} messages)>'
+
+
+class UploadJob(db.Model):
+    """A chat export being parsed in the background; the dashboard polls it until the ChatData row is ready."""
+    id = db.Column(db.String(32), primary_key=True)  # uuid4 hex
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    status = db.Column(db.String(16), nullable=False, default='queued')  # queued / ready / failed
+    chat_id = db.Column(db.Integer, db.ForeignKey('chat_data.id', ondelete='SET NULL'), nullable=True)
+    error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+    def __repr__(self):
+        return f'<UploadJob {self.id} {self.status}>'
+
+
+class BulkImportFile(db.Model):
+    """One export from a bulk-imported zip: the temp chat it was parsed into, or why it failed."""
+    id = db.Column(db.Integer, primary_key=True)
+    job_id = db.Column(db.String(32), db.ForeignKey('upload_job.id', ondelete='CASCADE'), nullable=False, index=True)
+    filename = db.Column(db.String(255), nullable=False)
+    size_bytes = db.Column(db.Integer, nullable=False)  # uncompressed size inside the zip
+    chat_id = db.Column(db.Integer, db.ForeignKey('chat_data.id', ondelete='SET NULL'), nullable=True)
+    error = db.Column(db.Text, nullable=True)
+
+    def __repr__(self):
+        return f'<BulkImportFile {self.filename!r} of job {self.job_id}>'
+
+
+class BulkPersona(db.Model):
+    """A bot built from a bulk import, listed on the job's page once every selected persona is ready."""
+    id = db.Column(db.Integer, primary_key=True)
+    job_id = db.Column(db.String(32), db.ForeignKey('upload_job.id', ondelete='CASCADE'), nullable=False, index=True)
+    chat_id = db.Column(db.Integer, db.ForeignKey('chat_data.id', ondelete='CASCADE'), nullable=False)
+    name = db.Column(db.String(255), nullable=False)
+
+    def __repr__(self):
+        return f'<BulkPersona {self.name!r} of job {self.job_id}>'
+
+
+def load_examples(chat_id):
+    """Return a chat's example messages (list of str) in order."""
+    rows = db.session.execute(
+        db.select(ExampleMessage.content)
+        .where(ExampleMessage.chat_id == chat_id)
+        .order_by(ExampleMessage.seq)
+    )
+    return [content for (content,) in rows]
+
+
+def replace_examples(chat_id, messages):
+    """Swap a chat's example messages for a new list (one bulk INSERT). Caller commits."""
+    db.session.execute(db.delete(ExampleMessage).where(ExampleMessage.chat_id == chat_id))
+    if messages:
+        db.session.execute(
+            db.insert(ExampleMessage),
+            [{'chat_id': chat_id, 'seq': seq, 'content': msg} for seq, msg in enumerate(messages)],
+        )
+
+
+def encode_messages(messages, level=6):
+    """List of str -> (zlib-compressed JSON bytes, uncompressed size)."""
+    raw = json.dumps(messages, ensure_ascii=False).encode('utf-8')
+    return zlib.compress(raw, level), len(raw)
+
+
+def decode_messages(data):
+    return json.loads(zlib.decompress(data).decode('utf-8'))
+
+
+def save_participant_blobs(chat_id, blobs):
+    """Store [(name, message count, raw bytes, compressed data)] for an uploaded chat. Caller commits."""
+    db.session.execute(
+        db.insert(ParticipantBlob),
+        [{'chat_id': chat_id, 'name': name, 'message_count': count, 'raw_bytes': raw_bytes, 'data': data}
+         for name, count, raw_bytes, data in blobs],
+    )
+
+
+def load_participants(chat_id):
+    """Return [{'name', 'count'}] for an uploaded chat, most active first. Reads only the small columns."""
+    rows = db.session.execute(
+        db.select(ParticipantBlob.name, ParticipantBlob.message_count)
+        .where(ParticipantBlob.chat_id == chat_id)
+        .order_by(ParticipantBlob.message_count.desc())
+    )
+    participants = [{'name': name, 'count': count} for name, count in rows]
+    if not participants:
+        # Uploaded before blobs were split per participant
+        legacy = db.session.execute(db.select(ChatData.all_messages).where(ChatData.id == chat_id)).scalar()
+        if legacy:
+            by_person = json.loads(legacy)
+            participants = sorted(({'name': name, 'count': len(msgs)} for name, msgs in by_person.items()),
+                                  key=lambda p: p['count'], reverse=True)
+    return participants
+
+
+def load_participant_messages(chat_id, name):
+    """Decode a single participant's messages (list of str); [] if they aren't in the chat."""
+    data = db.session.execute(
+        db.select(ParticipantBlob.data).where(ParticipantBlob.chat_id == chat_id, ParticipantBlob.name == name)
+    ).scalar()
+    if data is not None:
+        return decode_messages(data)
+    legacy = db.session.execute(db.select(ChatData.all_messages).where(ChatData.id == chat_id)).scalar()
+    return json.loads(legacy).get(name, []) if legacy else []
+
+
+def drop_participant_blobs(chat_ids):
+    """Delete the upload blobs of the given chats (after selection, or when temp rows expire). Caller commits."""
+    db.session.execute(db.delete(ParticipantBlob).where(ParticipantBlob.chat_id.in_(chat_ids)))
+
+
+def load_history(chat_id, window=20, after_seq=-1):
+    """
+    Return (last `window` turns after `after_seq` as [{"seq", "role", "content"}], next seq number) for a chat.
+    Only the window is read, using the (chat_id, seq) index.
+    """
+    rows = db.session.execute(
+        db.select(ConversationTurn.seq, ConversationTurn.role, ConversationTurn.content)
+        .where(ConversationTurn.chat_id == chat_id, ConversationTurn.seq > after_seq)
+        .order_by(ConversationTurn.seq.desc())
+        .limit(window)
+    ).all()
+    next_seq = rows[0].seq + 1 if rows else after_seq + 1
+    history = [{'seq': row.seq, 'role': row.role, 'content': row.content} for row in reversed(rows)]
+    return history, next_seq
+
+
+def load_summary(chat_id):
+    """Return (summary text, last seq it covers) for a chat; ('', -1) if nothing was summarized yet."""
+    summary = db.session.get(ConversationSummary, chat_id)
+    if summary is None:
+        return '', -1
+    return summary.content, summary.covered_seq
+
+
+def save_summary(chat_id, content, covered_seq):
+    """Insert or update a chat's running summary. Caller commits."""
+    summary = db.session.get(ConversationSummary, chat_id)
+    if summary is None:
+        summary = ConversationSummary(chat_id=chat_id)
+        db.session.add(summary)
+    summary.content = content
+    summary.covered_seq = covered_seq
+
+
+def load_profile(chat_id):
+    """Return a chat's style profile dict, or None if it was never built (chats selected before profiles)."""
+    profile = db.session.get(PersonaProfile, chat_id)
+    return json.loads(profile.data) if profile else None
+
+
+def save_profile(chat_id, data):
+    """Insert or replace a chat's style profile. Caller commits."""
+    profile = db.session.get(PersonaProfile, chat_id)
+    if profile is None:
+        profile = PersonaProfile(chat_id=chat_id)
+        db.session.add(profile)
+    profile.data = json.dumps(data)
+
+
+def append_turns(chat_id, turns):
+    """
+    Append-only insert of [(seq, role, content), ...]. Caller commits.
+    The unique (chat_id, seq) index makes a concurrent writer fail with IntegrityError instead of interleaving.
+    """
+    db.session.execute(
+        db.insert(ConversationTurn),
+        [{'chat_id': chat_id, 'seq': seq, 'role': role, 'content': content, 'created_at': datetime.utcnow()}
+         for seq, role, content in turns],
+    )
+
+
+def migrate_legacy_chat_data(batch_size=100):
+    """
+    Move examples/history still stored as JSON blobs on ChatData into the ExampleMessage and
+    ConversationTurn tables, then blank the old columns. Safe to run repeatedly.
+    Returns the number of chats migrated.
+    """
+    migrated = 0
+    while True:
+        batch = (ChatData.query
+                 .filter(ChatData.is_temp.is_(False))
+                 .filter(db.or_(ChatData.messages != '[]', ChatData.conversation_history != '[]'))
+                 .limit(batch_size)
+                 .all())
+        if not batch:
+            return migrated
+
+        for chat in batch:
+            try:
+                messages = json.loads(chat.messages or '[]')
+            except (json.JSONDecodeError, TypeError):
+                messages = []
+            try:
+                history = json.loads(chat.conversation_history or '[]')
+            except (json.JSONDecodeError, TypeError):
+                history = []
+
+            if messages and chat.example_messages.count() == 0:
+                replace_examples(chat.id, [m for m in messages if isinstance(m, str)])
+            if history and chat.conversation_turns.count() == 0:
+                turns = [(seq, msg.get('role'), msg.get('content', ''))
+                         for seq, msg in enumerate(history)
+                         if isinstance(msg, dict) and msg.get('role') in ('user', 'assistant')]
+                if turns:
+                    append_turns(chat.id, turns)
+
+            chat.messages = '[]'
+            chat.conversation_history = '[]'
+            migrated += 1
+
+        db.session.commit()
@@ -1,82 +1,164 @@
+import io
 import re
+import time
 from collections import defaultdict
-import json
+from itertools import chain, islice
 
-def parse_chat_file(chat_text):
+from metrics import record_stage, PARSED_MESSAGES
+
+# How many non-empty lines to look at before deciding which export format we're reading
+DETECT_SAMPLE_LINES = 50
+
+# Registry of supported export dialects, compiled once at import.
+# Every 'message' pattern captures the same groups: date, time, am/pm, sender, message.
+# The 'header' pattern matches only the timestamp prefix, so system lines
+# ("X added Y", "Messages are end-to-end encrypted") can be told apart from continuations.
+DIALECTS = {
+    # iOS: "[12/10/2023, 9:41:05 PM] Name: Message"
+    'ios': {
+        'message': re.compile(
+            r'^\[(\d{1,2}/\d{1,2}/\d{2,4}),\s*'   # [date,
+            r'(\d{1,2}:\d{2}(?::\d{2})?)\s*'      # h:mm or h:mm:ss (optional seconds)
+            r'(AM|PM)?\]\s*'                     # optional AM/PM]
+            r'([^:]+?):\s*'                      # sender:
+            r'(.*)$',                             # message
+            re.IGNORECASE
+        ),
+        'header': re.compile(
+            r'^\[\d{1,2}/\d{1,2}/\d{2,4},\s*\d{1,2}:\d{2}(?::\d{2})?\s*(?:AM|PM)?\]',
+            re.IGNORECASE
+        ),
+    },
+    # Android: "12/10/2023, 9:41 pm - Name: Message"
+    'android': {
+        'message': re.compile(
+            r'^(\d{1,2}/\d{1,2}/\d{2,4}),\s*'     # date
+            r'(\d{1,2}:\d{2}(?::\d{2})?)\s*'      # time
+            r'(AM|PM|a\.m\.|p\.m\.)?\s*-\s*'     # am/pm optional
+            r'([^:]+?):\s*'                      # sender
+            r'(.*)$',                             # message
+            re.IGNORECASE
+        ),
+        'header': re.compile(
+            r'^\d{1,2}/\d{1,2}/\d{2,4},\s*\d{1,2}:\d{2}(?::\d{2})?\s*(?:AM|PM|a\.m\.|p\.m\.)?\s*-\s*',
+            re.IGNORECASE
+        ),
+    },
+}
+
+def _iter_lines(source):
     """
-    Parse WhatsApp chat exported string.
-    Works for various formats:
-    - "dd/mm/yyyy, h:mm am/pm - Name: Message"
-    - Handles <Media omitted>, emojis, multiple spaces, non-breaking spaces
-    - Fallbacks for lines without proper timestamp
-    Returns:
-        {
-            'participants': [{'name': str, 'count': int}],  # top 2 by messages
-            'messages_by_person': {name: [msg1, msg2, ...]}
-        }
+    Yield cleaned, non-empty lines one at a time from a string or any text file-like object.
+    File objects are read lazily so large uploads never sit in memory as one list.
     """
-    lines = chat_text.strip().split('\n')
-    messages_by_person = defaultdict(list)
-    
-    # Flexible pattern: date, time, am/pm, dash, sender, message
-    """ pattern = re.compile(
-        r'^(\d{1,2}/\d{1,2}/\d{2,4}),\s*'     # date
-        r'(\d{1,2}:\d{2}(?:[:\d{2}]?)?)\s*'   # time
-        r'(AM|PM|am|pm|a\.m\.|p\.m\.)?\s*-\s*' # am/pm optional
-        r'([^:]+?):\s*'                        # sender
-        r'(.*)$',                               # message
-        re.IGNORECASE
-    )
-
-    pattern = re.compile(
-    r'^(\d{1,2}/\d{1,2}/\d{2,4}),\s*'     # date
-    r'(\d{1,2}:\d{2}(?:[:\d{2}]?)?)\s*'   # time
-    r'(AM|PM|am|pm|a\.m\.|p\.m\.)?\s*-\s*' # am/pm optional
-    r'([^:]+?):\s*'                        # sender
-    r'(.*)$',                               # message
-    re.IGNORECASE
-    )"""
-
-    pattern = re.compile(
-        r'^\[(\d{1,2}/\d{1,2}/\d{2,4}),\s*'   # [date,
-        r'(\d{1,2}:\d{2}(?::\d{2})?)\s*'      # h:mm or h:mm:ss (optional seconds)
-        r'(AM|PM)?\]\s*'                     # optional AM/PM]
-        r'([^:]+?):\s*'                      # sender:
-        r'(.*)$',                             # message
-        re.IGNORECASE
-    )
-
-    
+    if isinstance(source, str):
+        # Plain string input (old callers): StringIO iterates without building a line list
+        source = io.StringIO(source)
+    for line in source:
+        # iOS exports prefix attachment lines with an invisible left-to-right mark
+        line = line.strip().lstrip('\u200e')
+        if line:
+            yield line
+
+
+def detect_dialect(sample_lines):
+    """
+    Pick the dialect whose message pattern matches the most lines in the sample.
+    Returns the dialect name, or None if nothing in the sample looks like a chat export.
+    """
+    best_name, best_hits = None, 0
+    for name, dialect in DIALECTS.items():
+        hits = sum(1 for line in sample_lines if dialect['message'].match(line))
+        if hits > best_hits:
+            best_name, best_hits = name, hits
+    return best_name
+
+
+def iter_chat_messages(source, dialect=None):
+    """
+    Stream a WhatsApp export and yield one (timestamp, sender, message) tuple per message.
+    source: str or text file-like object (e.g. io.TextIOWrapper around the upload stream)
+    dialect: key into DIALECTS; auto-detected from the first DETECT_SAMPLE_LINES lines if None
+    Lines without a timestamp header are treated as continuations of the previous message.
+    """
+    lines = _iter_lines(source)
+
+    if dialect is None:
+        # Buffer only the sample, then chain it back in front of the rest of the stream
+        sample = list(islice(lines, DETECT_SAMPLE_LINES))
+        dialect = detect_dialect(sample)
+        if dialect is None:
+            raise ValueError("Unrecognized chat export format")
+        lines = chain(sample, lines)
+
+    # Bind the chosen patterns locally; only this dialect is tried for the rest of the file
+    message_match = DIALECTS[dialect]['message'].match
+    header_match = DIALECTS[dialect]['header'].match
 
+    current_timestamp = None
     current_sender = None
     current_message = []
 
     for line in lines:
-        line = line.strip()
-        if not line:
-            continue
-
-        match = pattern.match(line)
+        match = message_match(line)
         if match:
-            # Save previous message
+            # Emit previous message
             if current_sender:
                 full_message = "\n".join(current_message).strip()
-                if full_message or full_message == "<Media omitted>":
-                    messages_by_person[current_sender].append(full_message)
-            
+                if full_message:
+                    yield current_timestamp, current_sender, full_message
+
             # Start new message
+            date, clock, ampm = match.group(1), match.group(2), match.group(3)
+            current_timestamp = f"{date}, {clock} {ampm}" if ampm else f"{date}, {clock}"
             current_sender = match.group(4).strip()
             current_message = [match.group(5).strip()]
+        elif header_match(line):
+            # Timestamped system line (no sender): closes the current message
+            if current_sender:
+                full_message = "\n".join(current_message).strip()
+                if full_message:
+                    yield current_timestamp, current_sender, full_message
+            current_sender = None
+            current_message = []
         else:
             # Continuation of previous message
             if current_sender:
                 current_message.append(line)
 
-    # Save last message
+    # Emit last message
     if current_sender:
         full_message = "\n".join(current_message).strip()
-        if full_message or full_message == "<Media omitted>":
-            messages_by_person[current_sender].append(full_message)
+        if full_message:
+            yield current_timestamp, current_sender, full_message
+
+
+def parse_chat_file(chat_source, dialect=None, record_metrics=True):
+    """
+    Parse a WhatsApp chat export in a single streaming pass.
+    chat_source: str or text file-like object (read incrementally, nothing is written to disk)
+    dialect: force a format from DIALECTS; auto-detected when None
+    record_metrics: False in a pool worker, whose metrics would be lost with its process; the caller
+        records message_count / parse_seconds in the parent instead
+    Returns:
+        {
+            'participants': [{'name': str, 'count': int}],  # top 2 by messages
+            'messages_by_person': {name: [msg1, msg2, ...]},
+            'message_count': int,
+            'parse_seconds': float
+        }
+    """
+    messages_by_person = defaultdict(list)
+
+    count = 0
+    start = time.perf_counter()
+    for _timestamp, sender, message in iter_chat_messages(chat_source, dialect):
+        messages_by_person[sender].append(message)
+        count += 1
+    parse_seconds = time.perf_counter() - start
+    if record_metrics:
+        record_stage('parse_chat', parse_seconds)
+        PARSED_MESSAGES.inc(count)
 
     # Must have at least 2 participants
     if len(messages_by_person) < 2:
@@ -90,16 +172,9 @@ def parse_chat_file(chat_text):
     )[:2]
     participants = [{'name': name, 'count': len(msgs)} for name, msgs in sorted_participants]
 
-    with open("new.txt", 'w', encoding='utf-8') as f:
-            json.dump( {
-        'participants': participants,
-        'messages_by_person': messages_by_person  # all messages preserved
-    }, f, ensure_ascii=False, indent=4)
-       
-    print(f"\nChat data saved  in current directory.")
-
     return {
         'participants': participants,
-        'messages_by_person': messages_by_person  # all messages preserved
+        'messages_by_person': dict(messages_by_person),  # all messages preserved
+        'message_count': count,
+        'parse_seconds': parse_seconds
     }
-
@@ -0,0 +1,118 @@
+import heapq
+import math
+import random
+import re
+from collections import Counter, defaultdict
+from operator import itemgetter
+
+from text_patterns import squash_repeats
+
+# BM25 tuning (standard defaults)
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# Character n-gram size; 3-grams cope well with Roman Urdu spelling drift ("hai"/"hy", "yaar"/"yar")
+NGRAM_SIZE = 3
+
+# Grams found in more than this share of a big history (" ha", "ai ") barely move the ranking but their
+# posting lists are most of the work per query, so search skips them. Small histories are scanned in full.
+COMMON_GRAM_SHARE = 0.2
+COMMON_GRAM_MIN_DOCS = 500
+
+_word_re = re.compile(r'\w+|[^\w\s]', re.UNICODE)
+
+
+def char_ngrams(text, n=NGRAM_SIZE):
+    """
+    Turn a message into a Counter of character n-grams.
+    Lowercases and squashes repeated letters ("yaaaar" -> "yar") so spelling variants share grams.
+    Each word is padded with spaces so short words ("ok", "g") still produce grams.
+    """
+    padded = [f" {word} " for word in _word_re.findall(squash_repeats(text))]
+    return Counter(word[i:i + n] for word in padded for i in range(max(len(word) - n + 1, 1)))
+
+
+class StyleIndex:
+    """
+    In-memory BM25 index over a person's messages (character n-grams).
+    Built once per chat; used every turn to pick the examples most relevant to the user's input.
+    """
+
+    def __init__(self, messages):
+        self.messages = list(messages)
+        self.postings = defaultdict(list)  # gram -> [(doc_id, tf), ...]
+        self.doc_lengths = []
+
+        for doc_id, msg in enumerate(self.messages):
+            grams = char_ngrams(msg)
+            self.doc_lengths.append(sum(grams.values()))
+            for gram, tf in grams.items():
+                self.postings[gram].append((doc_id, tf))
+
+        n_docs = len(self.messages)
+        self.avg_length = (sum(self.doc_lengths) / n_docs) if n_docs else 0.0
+        # Precompute idf once per gram and the BM25 length norm once per doc instead of on every query
+        self.idf = {
+            gram: math.log(1 + (n_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+            for gram, docs in self.postings.items()
+        }
+        avg_length = self.avg_length or 1.0
+        self.doc_norms = [BM25_K1 * (1 - BM25_B + BM25_B * length / avg_length) for length in self.doc_lengths]
+        self.max_df = max(COMMON_GRAM_MIN_DOCS, int(n_docs * COMMON_GRAM_SHARE))
+
+    def __len__(self):
+        return len(self.messages)
+
+    def search(self, query, k=20):
+        """Return up to k (doc_id, score) pairs for the query, best first."""
+        if not self.messages:
+            return []
+
+        grams = [gram for gram in char_ngrams(query) if gram in self.postings]
+        if not grams:
+            return []
+        useful = [gram for gram in grams if len(self.postings[gram]) <= self.max_df]
+        if not useful:
+            # Nothing but common grams ("haha ok"): rank by the rarest one rather than return nothing
+            useful = [min(grams, key=lambda gram: len(self.postings[gram]))]
+
+        scores = defaultdict(float)
+        doc_norms = self.doc_norms
+        for gram in useful:
+            idf = self.idf[gram] * (BM25_K1 + 1)
+            for doc_id, tf in self.postings[gram]:
+                scores[doc_id] += idf * tf / (tf + doc_norms[doc_id])
+
+        return heapq.nlargest(k, scores.items(), key=itemgetter(1))
+
+    def select_examples(self, query, k=20, n_diverse=10, rng=random):
+        """
+        Pick style examples for one turn: top-k lexical matches for the query,
+        plus a small random sample from the rest of the history for overall tone.
+        Returns a list of message strings (duplicates removed, relevant ones first).
+        """
+        picked = [doc_id for doc_id, _score in self.search(query, k)]
+        chosen = set(picked)
+
+        remaining = len(self.messages) - len(chosen)
+        if n_diverse > 0 and remaining > 0:
+            # Rejection-sample ids so we never copy the whole message list
+            want = min(n_diverse, remaining)
+            attempts = 0
+            while want and attempts < want * 10:
+                attempts += 1
+                doc_id = rng.randrange(len(self.messages))
+                if doc_id not in chosen:
+                    chosen.add(doc_id)
+                    picked.append(doc_id)
+                    want -= 1
+
+        examples = []
+        seen = set()
+        for doc_id in picked:
+            msg = self.messages[doc_id]
+            if msg not in seen:
+                seen.add(msg)
+                examples.append(msg)
+        return examples
+
@@ -0,0 +1,229 @@
+import random
+import threading
+import time
+from collections import deque
+
+from config import Config
+from llm_backends import TIERS, backend_for, get_llm
+from llm_executor import llm_executor
+from metrics import Counter, Histogram, percentile
+
+LLM_TIER_SECONDS = Histogram('botme_llm_tier_seconds', 'LLM latency per model tier: whole call, or time to the '
+                             'first streamed chunk. Every attempt counts, hedges included.', ['tier', 'kind'])
+LLM_TIER_CALLS = Counter('botme_llm_tier_calls_total', 'LLM calls per model tier, by outcome.', ['tier', 'outcome'])
+LLM_ROUTED = Counter('botme_llm_routed_total', 'Chat turns per model tier, with the reason it was picked.',
+                     ['tier', 'reason'])
+
+
+def is_trivial(text, max_words=4):
+    """Short reactions and acknowledgements ("ok 😂", "hahaha", "acha theek hai") that don't need the big model."""
+    words = text.split()
+    return len(words) <= max_words and '?' not in text
+
+
+class LatencyTracker:
+    """
+    Recent durations (seconds) of one kind of call: at most the last `window` samples, none older than
+    max_age seconds, so a tier that had a bad spell is judged on fresh data once it's over.
+    """
+
+    def __init__(self, window=200, max_age=300, clock=time.monotonic):
+        self._values = deque(maxlen=window)  # (recorded at, seconds)
+        self.max_age = max_age
+        self._clock = clock
+        self._lock = threading.Lock()
+
+    def _expire(self):
+        cutoff = self._clock() - self.max_age
+        while self._values and self._values[0][0] < cutoff:
+            self._values.popleft()
+
+    def add(self, seconds):
+        with self._lock:
+            self._values.append((self._clock(), seconds))
+
+    def __len__(self):
+        with self._lock:
+            self._expire()
+            return len(self._values)
+
+    def percentile(self, pct):
+        """Nearest-rank percentile of the window, or None while it's empty."""
+        with self._lock:
+            self._expire()
+            values = sorted(seconds for _, seconds in self._values)
+        return percentile(values, pct)
+
+
+class Tier:
+    """
+    One model tier: its client (built lazily by llm_backends.get_llm unless one is passed in, e.g. a StubLLM
+    with an injected latency distribution) plus the recent latencies that drive routing and hedging.
+    """
+
+    def __init__(self, name, client=None, window=200, max_age=300):
+        self.name = name
+        self._client = client
+        self.calls = LatencyTracker(window, max_age)  # whole invoke() / stream() calls
+        self.first_chunks = LatencyTracker(window, max_age)  # stream() time to first chunk
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = get_llm(self.name)
+        return self._client
+
+    def _record(self, kind, tracker, seconds):
+        tracker.add(seconds)
+        LLM_TIER_SECONDS.observe(seconds, tier=self.name, kind=kind)
+
+    def invoke(self, prompt):
+        start = time.perf_counter()
+        try:
+            result = self.client.invoke(prompt)
+        except Exception:
+            LLM_TIER_CALLS.inc(tier=self.name, outcome='error')
+            raise
+        self._record('call', self.calls, time.perf_counter() - start)
+        LLM_TIER_CALLS.inc(tier=self.name, outcome='ok')
+        return result
+
+    def stream(self, prompt):
+        start = time.perf_counter()
+        first = True
+        try:
+            for chunk in self.client.stream(prompt):
+                if first:
+                    self._record('first_chunk', self.first_chunks, time.perf_counter() - start)
+                    first = False
+                yield chunk
+        except Exception:
+            LLM_TIER_CALLS.inc(tier=self.name, outcome='error')
+            raise
+        self._record('call', self.calls, time.perf_counter() - start)
+        LLM_TIER_CALLS.inc(tier=self.name, outcome='ok')
+
+
+class ModelRouter:
+    """
+    Picks the model tier for each turn and runs the call on the LLM executor, hedged.
+    tiers: {'main': Tier, 'fast': Tier}; without a "fast" tier every turn goes to "main"
+    max_words: inputs up to this many words (and not questions) count as trivial and go to "fast"
+    route_min_samples, demote_margin: trivial turns move to "main" only while both tiers have at least
+        route_min_samples recent calls and the p95 of "fast" is over demote_margin times that of "main"
+    probe_share: while "fast" is demoted, this share of trivial turns still goes to it, so its latency
+        window keeps updating and the tier comes back once it's healthy
+    hedge_percentile: a call still running after this percentile of its tier's recent latency gets a
+        duplicate (first-chunk latency for streams); 0 turns hedging off
+    hedge_min_delay: never hedge sooner than this (seconds)
+    hedge_min_samples: calls a tier must have seen before its latencies are trusted for hedging
+    """
+
+    def __init__(self, tiers, executor=llm_executor, max_words=4, hedge_percentile=95, hedge_min_delay=0.25,
+                 hedge_min_samples=20, route_min_samples=50, demote_margin=1.5, probe_share=0.1, rng=None):
+        self.tiers = tiers
+        self.executor = executor
+        self.max_words = max_words
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_min_samples = hedge_min_samples
+        self.route_min_samples = route_min_samples
+        self.demote_margin = demote_margin
+        self.probe_share = probe_share
+        self.rng = rng or random.Random()
+
+    def fast_tier_slow(self):
+        """True while "fast" has clearly been slower than "main" over enough recent calls."""
+        fast, main = self.tiers['fast'].calls, self.tiers['main'].calls
+        if len(fast) < self.route_min_samples or len(main) < self.route_min_samples:
+            return False
+        return fast.percentile(95) > main.percentile(95) * self.demote_margin
+
+    def choose(self, user_input):
+        """Return (tier, reason) for a chat turn."""
+        if 'fast' not in self.tiers:
+            tier, reason = 'main', 'single_tier'
+        elif not is_trivial(user_input, self.max_words):
+            tier, reason = 'main', 'complex'
+        elif not self.fast_tier_slow():
+            tier, reason = 'fast', 'trivial'
+        elif self.rng.random() < self.probe_share:
+            tier, reason = 'fast', 'probe'
+        else:
+            tier, reason = 'main', 'fast_tier_slow'
+        LLM_ROUTED.inc(tier=tier, reason=reason)
+        return tier, reason
+
+    def cheapest(self):
+        """Tier for background work like history summaries."""
+        return 'fast' if 'fast' in self.tiers else 'main'
+
+    def hedge_delay(self, tier, stream=False):
+        """Seconds to wait before hedging a call on this tier, or None (hedging off / too few samples)."""
+        tracker = self.tiers[tier].first_chunks if stream else self.tiers[tier].calls
+        if not self.hedge_percentile or len(tracker) < self.hedge_min_samples:
+            return None
+        return max(self.hedge_min_delay, tracker.percentile(self.hedge_percentile))
+
+    def invoke(self, prompt, tier='main', timeout=None):
+        tier = tier if tier in self.tiers else 'main'
+        return self.executor.run(self.tiers[tier].invoke, prompt, timeout=timeout,
+                                 hedge_after=self.hedge_delay(tier))
+
+    def stream(self, prompt, tier='main', timeout=None):
+        tier = tier if tier in self.tiers else 'main'
+        return self.executor.stream(self.tiers[tier].stream, prompt, timeout=timeout,
+                                    hedge_after=self.hedge_delay(tier, stream=True))
+
+    def prewarm(self):
+        for tier in self.tiers.values():
+            tier.client
+
+    def stats(self):
+        """{tier: {'calls', 'p50', 'p95', 'first_chunk_p95'}} over the recent window (seconds)."""
+        return {
+            name: {
+                'calls': len(tier.calls),
+                'p50': tier.calls.percentile(50),
+                'p95': tier.calls.percentile(95),
+                'first_chunk_p95': tier.first_chunks.percentile(95),
+            }
+            for name, tier in self.tiers.items()
+        }
+
+
+def router_from_config():
+    """A router over the configured tiers ("fast" only when LLM_FAST_BACKEND is set)."""
+    tiers = {name: Tier(name, window=Config.LLM_LATENCY_WINDOW, max_age=Config.LLM_LATENCY_MAX_AGE)
+             for name in TIERS if backend_for(name)}
+    return ModelRouter(
+        tiers,
+        max_words=Config.LLM_ROUTE_MAX_WORDS,
+        hedge_percentile=Config.LLM_HEDGE_PERCENTILE,
+        hedge_min_delay=Config.LLM_HEDGE_MIN_DELAY,
+        hedge_min_samples=Config.LLM_HEDGE_MIN_SAMPLES,
+        route_min_samples=Config.LLM_ROUTE_MIN_SAMPLES,
+        demote_margin=Config.LLM_ROUTE_DEMOTE_MARGIN,
+        probe_share=Config.LLM_ROUTE_PROBE_SHARE,
+    )
+
+
+_router = None
+_router_lock = threading.Lock()
+
+
+def get_router():
+    """The process-wide router, built from the config on first use (clients stay lazy until called)."""
+    global _router
+    if _router is None:
+        with _router_lock:
+            if _router is None:
+                _router = router_from_config()
+    return _router
+
+
+def set_router(router):
+    """Swap in another router, e.g. one over stub tiers with injected latencies in a benchmark."""
+    global _router
+    with _router_lock:
+        _router = router
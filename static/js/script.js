@@ -12,6 +12,21 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     });
 
+    // Upload form: send in the background and poll the parse job instead of waiting on the request
+    const uploadForm = document.getElementById('upload-form');
+    if (uploadForm) {
+        uploadForm.addEventListener('submit', function(e) {
+            e.preventDefault();
+            startUpload(uploadForm);
+        });
+    }
+
+    // Page opened after a non-JS upload redirect: resume polling that job
+    const uploadStatus = document.getElementById('upload-status');
+    if (uploadStatus && uploadStatus.dataset.jobId) {
+        pollUploadJob(`/api/upload/${uploadStatus.dataset.jobId}`, uploadStatus.dataset.statusText);
+    }
+
     // Chat input: Handle Enter key to send message
     const messageInput = document.getElementById('message-input');
     if (messageInput) {
@@ -30,6 +45,75 @@ document.addEventListener('DOMContentLoaded', function() {
     // No welcome message - chat starts empty, user initiates
 });
 
+// Show upload progress text under the upload form
+function setUploadStatus(text, isError = false) {
+    const statusEl = document.getElementById('upload-status');
+    if (statusEl) {
+        statusEl.textContent = text;
+        statusEl.style.color = isError ? '#c0392b' : '';
+    }
+}
+
+// Reset the upload button after a failure so the user can try again
+function resetUploadButton() {
+    const submitBtn = document.querySelector('#upload-form button[type="submit"]');
+    if (submitBtn) {
+        submitBtn.innerHTML = 'Upload & Analyze';
+        submitBtn.disabled = false;
+    }
+}
+
+// Post the file, get a job id back immediately, then poll until the chat is parsed
+async function startUpload(form) {
+    setUploadStatus('Uploading...');
+    try {
+        const response = await fetch(form.action, {
+            method: 'POST',
+            headers: { 'Accept': 'application/json' },
+            body: new FormData(form),
+        });
+        const data = await response.json();
+        if (!response.ok || data.error) {
+            throw new Error(data.error || `HTTP error! status: ${response.status}`);
+        }
+        pollUploadJob(data.status_url);
+    } catch (error) {
+        setUploadStatus(error.message, true);
+        resetUploadButton();
+    }
+}
+
+// Stop polling after this long; a job still queued by then isn't coming back
+const UPLOAD_POLL_TIMEOUT_MS = 10 * 60 * 1000;
+
+async function pollUploadJob(statusUrl, statusText = 'Analyzing chat...') {
+    setUploadStatus(statusText);
+    const startedAt = Date.now();
+    try {
+        while (true) {
+            if (Date.now() - startedAt > UPLOAD_POLL_TIMEOUT_MS) {
+                throw new Error('Processing the upload is taking too long. Please try uploading again.');
+            }
+            const response = await fetch(statusUrl, { headers: { 'Accept': 'application/json' } });
+            const data = await response.json();
+            if (!response.ok) {
+                throw new Error(data.error || `HTTP error! status: ${response.status}`);
+            }
+            if (data.status === 'ready') {
+                window.location.href = data.select_url;
+                return;
+            }
+            if (data.status === 'failed') {
+                throw new Error(data.error);
+            }
+            await new Promise(resolve => setTimeout(resolve, 1000));
+        }
+    } catch (error) {
+        setUploadStatus(error.message, true);
+        resetUploadButton();
+    }
+}
+
 // Extract chat_id from the chat page (data attribute fallback)
 function getChatIdFromPage() {
     const chatContainer = document.querySelector('.chat-container');
@@ -39,6 +123,21 @@ function getChatIdFromPage() {
     return null;
 }
 
+// Escape HTML for safety, keep line breaks and truncate very long messages
+function formatMessageContent(content) {
+    let safeContent = content
+        .replace(/&/g, '&amp;')
+        .replace(/</g, '&lt;')
+        .replace(/>/g, '&gt;')
+        .replace(/\n/g, '<br>');  // Preserve line breaks properly
+    
+    // Truncate very long messages (e.g., verbose GPT replies)
+    if (content.length > 500) {
+        safeContent = safeContent.substring(0, 500) + '<br><em style="color: #999;">...</em>';
+    }
+    return safeContent;
+}
+
 // Add a message to the chat (user or bot)
 function addMessage(sender, content, isLoading = false) {
     const messagesContainer = document.getElementById('chat-messages');
@@ -52,19 +151,7 @@ function addMessage(sender, content, isLoading = false) {
         content = '<div class="typing-indicator"><span></span><span></span><span></span></div>';
         messageDiv.classList.add('loading');
     } else {
-        // Escape HTML for safety and replace newlines
-        let safeContent = content
-            .replace(/&/g, '&amp;')
-            .replace(/</g, '&lt;')
-            .replace(/>/g, '&gt;')
-            .replace(/\n/g, '<br>');  // Preserve line breaks properly
-        
-        // Truncate very long messages (e.g., verbose GPT replies)
-        if (content.length > 500) {
-            safeContent = safeContent.substring(0, 500) + '<br><em style="color: #999;">...</em>';
-        }
-        
-        messageDiv.innerHTML = safeContent;
+        messageDiv.innerHTML = formatMessageContent(content);
     }
 
     messagesContainer.appendChild(messageDiv);
@@ -115,8 +202,8 @@ async function sendMessage(chatId) {
         // Show bot typing indicator
         botLoadingDiv = addMessage('bot', '', true);
 
-        // Send to backend API
-        const response = await fetch(`/api/chat/${chatId}`, {
+        // Stream the reply from the backend (server-sent events over a POST)
+        const response = await fetch(`/api/chat/${chatId}/stream`, {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json',
@@ -125,19 +212,32 @@ async function sendMessage(chatId) {
         });
 
         if (!response.ok) {
-            throw new Error(`HTTP error! status: ${response.status}`);
+            // 503 = server busy, 400 = bad input: show the server's message if there is one
+            let message = `HTTP error! status: ${response.status}`;
+            try {
+                const data = await response.json();
+                if (data.error) message = data.error;
+            } catch (e) { /* not JSON */ }
+            throw new Error(message);
         }
 
-        const data = await response.json();
-        if (data.error) {
-            throw new Error(data.error);
-        }
+        // Render tokens into the bot bubble as they arrive
+        let replyText = '';
+        await readEventStream(response, (token) => {
+            replyText += token;
+            if (botLoadingDiv) {
+                botLoadingDiv.classList.remove('loading');
+                botLoadingDiv.innerHTML = formatMessageContent(replyText);
+                messagesContainer.scrollTop = messagesContainer.scrollHeight;
+            }
+        });
 
-        // Remove loading and add bot response
-        if (botLoadingDiv && botLoadingDiv.parentNode) {
-            messagesContainer.removeChild(botLoadingDiv);
+        if (!replyText) {
+            if (botLoadingDiv && botLoadingDiv.parentNode) {
+                messagesContainer.removeChild(botLoadingDiv);
+            }
+            addMessage('bot', 'Sorry, I could not generate a response.');
         }
-        addMessage('bot', data.response || 'Sorry, I could not generate a response.');
 
     } catch (error) {
         console.error('Chat error:', error);
@@ -159,6 +259,39 @@ async function sendMessage(chatId) {
     }
 }
 
+// Read a text/event-stream response, calling onToken for each 'data:' chunk until 'event: done'
+async function readEventStream(response, onToken) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        // Events are separated by a blank line
+        let boundary;
+        while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+            const rawEvent = buffer.slice(0, boundary);
+            buffer = buffer.slice(boundary + 2);
+
+            let eventType = 'message';
+            let data = '';
+            rawEvent.split('\n').forEach(line => {
+                if (line.startsWith('event:')) eventType = line.slice(6).trim();
+                else if (line.startsWith('data:')) data += line.slice(5).trim();
+            });
+
+            if (eventType === 'done') return;
+            if (data) {
+                const payload = JSON.parse(data);
+                if (payload.token) onToken(payload.token);
+            }
+        }
+    }
+}
+
 // Optional: Add a welcome message initializer (if needed in future)
 // Call this if needed, e.g., from chat.html
 function initializeChat(chatId) {
@@ -0,0 +1,166 @@
+import re
+from collections import Counter
+
+from metrics import percentile
+from text_patterns import EMOJI_RE, squash_repeats
+
+# Export artefacts that say nothing about how someone writes (iOS ends some of them with a period)
+_NOISE_RE = re.compile(
+    r'^(<media omitted>|<attached: [^>]*>|(image|video|audio|sticker|gif|document|contact card) omitted'
+    r'|this message was deleted|you deleted this message|null|missed (voice|video) call'
+    r'|waiting for this message\. check your phone)\.?$',
+    re.IGNORECASE
+)
+# iOS puts a left-to-right mark before placeholders and narrow no-break spaces around times
+_IOS_MARKS = str.maketrans({'\u200e': None, '\u202f': ' '})
+_EDITED_RE = re.compile(r'\s*<this message was edited>\s*$', re.IGNORECASE)
+_WORD_RE = re.compile(r"[a-zA-Z']+")
+
+# Function words ignored when looking for someone's favourite words
+STOPWORDS = {
+    'hai', 'ha', 'hain', 'hy', 'he', 'ho', 'hon', 'hun', 'tha', 'thi', 'the', 'ki', 'ka', 'ke', 'ko', 'se',
+    'me', 'main', 'mein', 'mai', 'mn', 'to', 'tu', 'tum', 'ap', 'aap', 'apka', 'bhi', 'or', 'aur', 'ye', 'yeh',
+    'wo', 'woh', 'is', 'us', 'a', 'an', 'i', 'it', 'of', 'in', 'on', 'and', 'for', 'you', 'kr', 'kar',
+    'ne', 'na', 'ni', 'nai', 'k', 'b', 'do', 'de', 'di', 'da', 'ga', 'gi', 'ge',
+}
+
+# Common English words that don't double as Roman Urdu; used to estimate code-switching
+ENGLISH_WORDS = {
+    'the', 'and', 'you', 'that', 'this', 'with', 'what', 'have', 'are', 'was', 'will', 'can', 'just', 'not',
+    'but', 'all', 'they', 'your', 'about', 'would', 'there', 'their', 'which', 'when', 'make', 'like', 'time',
+    'know', 'take', 'people', 'good', 'some', 'could', 'them', 'see', 'other', 'than', 'then', 'now', 'look',
+    'only', 'come', 'think', 'also', 'back', 'after', 'work', 'first', 'well', 'way', 'even', 'want', 'because',
+    'any', 'these', 'give', 'day', 'most', 'please', 'thanks', 'thank', 'sorry', 'okay', 'ok', 'done', 'yes',
+    'sure', 'really', 'class', 'exam', 'notes', 'today', 'tomorrow', 'tonight', 'bro', 'dude', 'man', 'love',
+    'send', 'call', 'wait', 'sleep', 'bad', 'nice', 'great', 'actually', 'anyway', 'literally', 'basically',
+    'seriously', 'same', 'why', 'how', 'where', 'who', 'should', 'did', 'does', 'going', 'got', 'get',
+    'right', 'still', 'never', 'always', 'maybe', 'very', 'much', 'more', 'been', 'said', 'tell', 'bye',
+    'hello', 'hey', 'morning', 'night', 'busy', 'free', 'plan', 'late', 'lol', 'omg', 'btw', 'idk',
+}
+
+
+def _is_noise(line):
+    if not line or _NOISE_RE.match(line):
+        return True
+    # Keep emoji-only replies (they're style), drop things like "." or "..."
+    return not re.search(r'\w', line) and not EMOJI_RE.search(line)
+
+
+def clean_message(msg):
+    """
+    Strip edit markers and noise lines (media placeholders, deleted messages, lone punctuation)
+    from a possibly multi-line message. Returns None if nothing is left.
+    """
+    lines = []
+    for line in msg.split('\n'):
+        line = _EDITED_RE.sub('', line.translate(_IOS_MARKS)).strip()
+        if not _is_noise(line) and line not in lines:
+            lines.append(line)
+    return '\n'.join(lines) or None
+
+
+def _dedupe_key(msg):
+    words = _WORD_RE.findall(squash_repeats(msg))
+    return ' '.join(words) if words else msg.strip()
+
+
+def clean_messages(messages):
+    """Drop noise and near-identical repeats ("okkk" == "Ok!"), keeping first occurrences in order."""
+    seen = set()
+    kept = []
+    for msg in messages:
+        msg = clean_message(msg)
+        if msg is None:
+            continue
+        key = _dedupe_key(msg)
+        if key in seen:
+            continue
+        seen.add(key)
+        kept.append(msg)
+    return kept
+
+
+def curate_examples(messages, n=25, max_words=40):
+    """
+    Pick n representative messages, spread evenly over the length distribution
+    (so both the one-word replies and the longer rants are shown). Deterministic.
+    """
+    candidates = [m for m in messages if len(m.split()) <= max_words]
+    if len(candidates) <= n:
+        return candidates
+    by_length = sorted(candidates, key=len)
+    step = len(by_length) / n
+    return [by_length[int(i * step + step / 2)] for i in range(n)]
+
+
+def build_style_profile(messages, n_examples=25):
+    """
+    Compute a compact style fingerprint from a person's messages (noise is dropped first).
+    Returns a JSON-serializable dict with length stats, favourite words, emoji, openers,
+    English/Roman Urdu mix and a curated example set.
+    """
+    cleaned = [m for m in (clean_message(msg) for msg in messages) if m is not None]
+    unique = clean_messages(cleaned)
+
+    word_counts = Counter()
+    emoji_counts = Counter()
+    openers = Counter()
+    lengths = []
+    english = total_words = lowercase_msgs = question_msgs = emoji_msgs = 0
+
+    for msg in cleaned:
+        words = [w.lower() for w in _WORD_RE.findall(msg)]
+        lengths.append(len(msg.split()))
+        emojis = EMOJI_RE.findall(msg)
+        emoji_counts.update(emojis)
+        emoji_msgs += bool(emojis)
+        if words:
+            openers[words[0]] += 1
+            total_words += len(words)
+            english += sum(1 for w in words if w in ENGLISH_WORDS)
+            word_counts.update(w for w in words if len(w) > 1 and w not in STOPWORDS)
+        lowercase_msgs += msg == msg.lower()
+        question_msgs += '?' in msg
+
+    lengths.sort()
+    n_msgs = len(cleaned) or 1
+    return {
+        'messages_analyzed': len(cleaned),
+        'noise_dropped': len(messages) - len(cleaned),
+        'duplicates_dropped': len(cleaned) - len(unique),
+        'length_median_words': percentile(lengths, 50, default=0),
+        'length_p90_words': percentile(lengths, 90, default=0),
+        'short_share': round(sum(1 for n in lengths if n <= 2) / n_msgs, 2),
+        'top_words': [w for w, _ in word_counts.most_common(12)],
+        'top_emoji': [e for e, _ in emoji_counts.most_common(6)],
+        'emoji_share': round(emoji_msgs / n_msgs, 2),
+        'top_openers': [w for w, c in openers.most_common(6) if c > 1],
+        'english_ratio': round(english / total_words, 2) if total_words else 0.0,
+        'lowercase_share': round(lowercase_msgs / n_msgs, 2),
+        'question_share': round(question_msgs / n_msgs, 2),
+        'examples': curate_examples(unique, n_examples),
+    }
+
+
+def format_style_profile(profile):
+    """Render the fingerprint as a few short bullet lines for the prompt."""
+    lines = [
+        f"- Message length: usually {profile['length_median_words']} words, rarely more than "
+        f"{profile['length_p90_words']}; {int(profile['short_share'] * 100)}% are one- or two-word replies.",
+    ]
+    if profile['top_words']:
+        lines.append(f"- Favourite words/slang: {', '.join(profile['top_words'])}.")
+    if profile['top_emoji']:
+        lines.append(f"- Emoji ({int(profile['emoji_share'] * 100)}% of messages): {' '.join(profile['top_emoji'])}.")
+    else:
+        lines.append("- Hardly ever uses emoji.")
+    if profile['top_openers']:
+        lines.append(f"- Often starts with: {', '.join(profile['top_openers'])}.")
+    lines.append(
+        f"- Language mix: about {int(profile['english_ratio'] * 100)}% English words, the rest Roman Urdu."
+    )
+    lines.append(
+        f"- Writes in lowercase {int(profile['lowercase_share'] * 100)}% of the time; "
+        f"{int(profile['question_share'] * 100)}% of messages are questions."
+    )
+    return "\n".join(lines)
@@ -0,0 +1,51 @@
+from caching import LRUCache, ResponseCache, normalize_input
+
+
+def make_cache():
+    return ResponseCache(variants=1)  # one stored reply is always served
+
+
+def test_one_word_change_is_not_a_fuzzy_hit():
+    cache = make_cache()
+    cache.add(1, '', 'mujhe pizza pasand hai', 'haan yaar mujhe bhi')
+    assert cache.get(1, '', 'mujhe pizza pasand nahi hai')[0] is None
+    assert cache.get(1, '', 'tujhe pizza pasand hai')[0] is None
+    assert cache.get(1, '', 'Mujhe pizza pasand hai!!')[1] == 'exact'
+
+
+def test_short_inputs_still_match_fuzzily():
+    cache = make_cache()
+    cache.add(1, '', 'hahaha', '😂😂')
+    cache.add(1, '', '😂', 'lol')
+    assert cache.get(1, '', 'hahahahaha') == ('😂😂', 'fuzzy', 0.0)
+    assert cache.get(1, '', '😂😂😂')[:2] == ('lol', 'fuzzy')
+
+
+def test_numbers_are_not_squashed():
+    assert normalize_input('kal 100 baje') != normalize_input('kal 10 baje')
+    assert normalize_input('Yaaaar') == normalize_input('yar')
+    cache = make_cache()
+    cache.add(1, '', 'kal 100 baje', 'theek hai')
+    assert cache.get(1, '', 'kal 10 baje')[0] is None
+
+
+def test_fingerprint_follows_the_users_previous_message():
+    before = [{'role': 'user', 'content': 'kal milte hain'}, {'role': 'assistant', 'content': 'pakka, 5 baje'}]
+    again = [{'role': 'user', 'content': 'Kal milte hain'}, {'role': 'assistant', 'content': 'haan done'}]
+    other = [{'role': 'user', 'content': 'exam fail ho gaya'}, {'role': 'assistant', 'content': 'pakka, 5 baje'}]
+    assert ResponseCache.fingerprint(before) == ResponseCache.fingerprint(again)
+    assert ResponseCache.fingerprint(before) != ResponseCache.fingerprint(other)
+    assert ResponseCache.fingerprint([]) == ''
+
+
+def test_sliding_ttl_keeps_active_entries(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr('caching.time.monotonic', lambda: now[0])
+    fixed, sliding = LRUCache(ttl=10), LRUCache(ttl=10, sliding=True)
+    for cache in (fixed, sliding):
+        cache.set('chat', 'session')
+    for now[0] in (6.0, 12.0):
+        assert sliding.get('chat') == 'session'
+    assert fixed.get('chat') is None
+    now[0] = 30.0
+    assert sliding.get('chat') is None
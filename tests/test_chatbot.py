@@ -0,0 +1,44 @@
+from chatbot import PersonaSession
+from token_budget import PromptBudget, count_tokens
+
+
+def make_session(messages=(), **budget):
+    session = PersonaSession(None, 'Ali', ['kya haal hai', 'kal milte hain', 'theek hai yaar'], list(messages), 0)
+    session.budget = PromptBudget(**budget)
+    return session
+
+
+def turns(n, words=20):
+    return [{'seq': i, 'role': 'user' if i % 2 == 0 else 'assistant', 'content': f'message {i} ' + 'yaar ' * words}
+            for i in range(n)]
+
+
+def test_prompt_trims_reloaded_history_and_long_input():
+    session = make_session(turns(50), history=200, input=50)
+    prompt = session.render_prompt('bohat lamba message ' * 500)
+    assert 'message 49 ' in prompt
+    assert 'message 0 ' not in prompt
+    assert count_tokens(prompt) < session.budget.total
+
+
+def test_no_second_fold_while_one_is_pending():
+    session = make_session(history=100)
+    _, to_fold = session.record_turn('hello ' * 60, 'hi ' * 60)
+    assert to_fold and session.folding == to_fold
+    # Messages being folded are still rendered until the summary lands
+    assert 'Ali: hi hi' in session.render_history()
+    _, again = session.record_turn('phir ' * 60, 'haan ' * 60)
+    assert again == []
+
+    session.apply_summary('they said hello', to_fold[-1]['seq'])
+    assert session.folding == []
+    _, later = session.record_turn('ok', 'ok')
+    assert later
+
+
+def test_cancelled_fold_goes_back_into_history():
+    session = make_session(history=100)
+    _, to_fold = session.record_turn('hello ' * 60, 'hi ' * 60)
+    session.cancel_fold()
+    assert session.folding == []
+    assert [msg['seq'] for msg in session.history][:len(to_fold)] == [msg['seq'] for msg in to_fold]
@@ -0,0 +1,25 @@
+from retrieval import StyleIndex
+
+
+def make_index(n=3000):
+    filler = ['haha ok', 'ok yaar', 'haha acha'] * (n // 3)
+    return StyleIndex(filler + ['kal cricket match hai', 'cricket khelne chalein?'])
+
+
+def test_search_skips_common_grams_but_keeps_rare_matches():
+    index = make_index()
+    assert len(index.postings[' ok']) > index.max_df
+    top = [index.messages[doc_id] for doc_id, _score in index.search('haha cricket ok', 2)]
+    assert sorted(top) == ['cricket khelne chalein?', 'kal cricket match hai']
+
+
+def test_search_with_only_common_grams_still_ranks():
+    index = make_index()
+    results = index.search('haha ok', 5)
+    assert len(results) == 5
+    assert [score for _doc_id, score in results] == sorted((score for _doc_id, score in results), reverse=True)
+
+
+def test_small_history_uses_every_gram():
+    index = StyleIndex(['ok', 'ok yaar', 'haha'])
+    assert index.search('ok yaar', 1)[0][0] == 1
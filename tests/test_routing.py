@@ -0,0 +1,77 @@
+import random
+
+from llm_backends import StubLLM
+from llm_executor import LLMExecutor
+from routing import LatencyTracker, ModelRouter, Tier
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_router(fast_latency, main_latency=0.01, **kwargs):
+    tiers = {
+        'main': Tier('main', StubLLM(latency=main_latency)),
+        'fast': Tier('fast', StubLLM(latency=fast_latency)),
+    }
+    kwargs.setdefault('rng', random.Random(0))
+    return ModelRouter(tiers, executor=LLMExecutor(max_concurrency=4, max_queue=4, timeout=5), hedge_percentile=0,
+                       **kwargs)
+
+
+def test_single_outlier_does_not_demote_fast_tier():
+    router = make_router(0.0)
+    for seconds in [0.3] + [0.001] * 59:
+        router.tiers['fast'].calls.add(seconds)
+    for _ in range(60):
+        router.tiers['main'].calls.add(0.02)
+    assert not router.fast_tier_slow()
+    assert router.choose('ok 😂') == ('fast', 'trivial')
+
+
+def test_fast_tier_recovers_after_spike():
+    latencies = iter([0.05] * 12)  # a bad spell on "fast", then back to normal
+    router = make_router(lambda: next(latencies, 0.001), route_min_samples=10, probe_share=0.3)
+    router.tiers['fast'] = Tier('fast', router.tiers['fast'].client, window=20)
+
+    # Warm both tiers: "main" through complex turns, "fast" through trivial ones during its spike
+    for _ in range(12):
+        tier, _ = router.choose('kal class ka kya scene hai yaar batao?')
+        router.invoke('p', tier)
+    for _ in range(12):
+        tier, _ = router.choose('ok')
+        router.invoke('p', tier)
+    assert router.fast_tier_slow()
+
+    reasons = []
+    for _ in range(200):
+        tier, reason = router.choose('ok')
+        reasons.append(reason)
+        router.invoke('p', tier)
+    assert 'probe' in reasons and 'fast_tier_slow' in reasons
+    assert not router.fast_tier_slow()
+    assert reasons[-20:] == ['trivial'] * 20
+
+
+def test_latency_samples_expire():
+    clock = FakeClock()
+    tracker = LatencyTracker(window=100, max_age=60, clock=clock)
+    tracker.add(5.0)
+    clock.now = 30
+    tracker.add(0.1)
+    assert len(tracker) == 2 and tracker.percentile(95) == 5.0
+    clock.now = 61
+    assert len(tracker) == 1 and tracker.percentile(95) == 0.1
+
+
+def test_percentile_is_nearest_rank():
+    tracker = LatencyTracker(window=100)
+    for seconds in range(1, 21):
+        tracker.add(seconds)
+    assert tracker.percentile(95) == 19
+    assert tracker.percentile(50) == 10
+    assert tracker.percentile(100) == 20
@@ -0,0 +1,12 @@
+from style_profile import clean_messages
+
+
+def test_ios_placeholders_are_noise():
+    messages = ['\u200eimage omitted', '\u200e<attached: 00000012-PHOTO.jpg>', '\u200esticker omitted',
+                'This message was deleted.', 'You deleted this message.']
+    assert clean_messages(messages) == []
+
+
+def test_ios_marks_are_stripped_from_kept_messages():
+    assert clean_messages(['\u200ekal milte hain', 'chalo 5\u202fPM pe', 'ok yaar.']) == \
+        ['kal milte hain', 'chalo 5 PM pe', 'ok yaar.']
@@ -0,0 +1,12 @@
+import re
+
+# Text normalisation shared by retrieval, the response cache and the style profile, so they agree on what
+# counts as an emoji and on "yaaaar" == "yar" (but not "100" == "10": only letters are squashed)
+
+EMOJI_RE = re.compile('[\U0001F300-\U0001FAFF\u2600-\u27BF\u2B50\u2764]')
+REPEAT_RE = re.compile(r'([^\W\d_])\1+')
+
+
+def squash_repeats(text):
+    """Lowercase and collapse runs of the same letter ("Yaaaar 100" -> "yar 100")."""
+    return REPEAT_RE.sub(r'\1', text.lower())
@@ -0,0 +1,132 @@
+import logging
+import threading
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+_encoding = None
+_encoding_loaded = False
+_encoding_lock = threading.Lock()
+
+
+def _get_encoding():
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        with _encoding_lock:
+            if not _encoding_loaded:
+                _encoding = _load_encoding()
+                _encoding_loaded = True
+    return _encoding
+
+
+def prewarm_tokenizer():
+    """Load the tokenizer (and download its BPE files) ahead of the first chat."""
+    _get_encoding()
+
+
+def _load_encoding():
+    # tiktoken ships with langchain-openai; imported on first use (not at startup), estimated if it isn't installed
+    try:
+        import tiktoken
+        try:
+            return tiktoken.encoding_for_model(Config.TOKENIZER_MODEL)
+        except KeyError:
+            return tiktoken.get_encoding("cl100k_base")
+    except ImportError:
+        return None
+    except Exception as e:
+        # tiktoken downloads its BPE files on first use; offline we just estimate
+        logger.warning("Tokenizer unavailable, estimating token counts: %s", e)
+        return None
+
+
+def count_tokens(text):
+    """Number of tokens the model will see for this text (about 4 chars/token without tiktoken)."""
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is None:
+        return max(1, len(text) // 4)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_to_tokens(text, max_tokens):
+    """Cut text down to at most max_tokens tokens."""
+    encoding = _get_encoding()
+    if encoding is None:
+        return text[:max_tokens * 4]
+    tokens = encoding.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    return encoding.decode(tokens[:max_tokens])
+
+
+def fit_to_budget(lines, budget):
+    """
+    Keep lines (in order) while their total token count stays within budget.
+    Used for examples, which come in relevance order, so the least relevant are dropped first.
+    """
+    kept = []
+    used = 0
+    for line in lines:
+        cost = count_tokens(line) + 1  # +1 for the joining newline
+        if used + cost > budget:
+            break
+        kept.append(line)
+        used += cost
+    return kept
+
+
+class PromptBudget:
+    """
+    Splits the prompt token budget between its parts:
+    fixed instructions, recent history (+ running summary), the user's input, and style examples.
+    Examples get whatever is left after the other parts.
+    """
+
+    def __init__(self, total=None, history=None, summary=None, input=None):
+        self.total = total if total is not None else Config.PROMPT_TOKEN_BUDGET
+        self.history = history if history is not None else Config.HISTORY_TOKEN_BUDGET
+        self.summary = summary if summary is not None else Config.SUMMARY_MAX_TOKENS
+        self.input = input if input is not None else Config.INPUT_TOKEN_BUDGET
+
+    def fit_input(self, text):
+        """The user's message, cut to the input budget."""
+        return truncate_to_tokens(text, self.input)
+
+    def fit_history(self, history):
+        """
+        The newest messages whose tokens fit the history budget (oldest first, like history).
+        A window just reloaded from the DB can be well over budget until its next fold.
+        """
+        used = 0
+        start = len(history)
+        while start > 0 and used + history[start - 1]["tokens"] <= self.history:
+            start -= 1
+            used += history[start]["tokens"]
+        return history[start:]
+
+    def examples_budget(self, fixed_tokens, history_tokens, input_tokens):
+        return max(0, self.total - fixed_tokens - history_tokens - input_tokens)
+
+    def split_history(self, history):
+        """
+        Decide which old messages to fold into the summary.
+        history: list of dicts with a "tokens" count, oldest first.
+        Returns (to_fold, to_keep). Nothing is folded until the history budget is exceeded;
+        then the oldest messages go until at most half the budget is left, so folding is rare.
+        """
+        total = sum(msg["tokens"] for msg in history)
+        if total <= self.history:
+            return [], history
+
+        target = self.history // 2
+        cut = 0
+        while cut < len(history) and total > target:
+            total -= history[cut]["tokens"]
+            cut += 1
+        # Fold whole exchanges so the kept window never starts with an assistant reply
+        if cut < len(history) and history[cut].get("role") == "assistant":
+            cut += 1
+        return history[:cut], history[cut:]